@@ -0,0 +1,102 @@
+"""
+Admin dashboard analytics computed in a single pass over the users table.
+
+All headline counts are FILTER aggregates of one query; the optional
+breakdowns are extra GROUPING SETS of that same query, so they do not cost
+additional table scans. Results are cached for a short TTL and invalidated
+whenever a user is registered, updated or deleted.
+"""
+import os
+from datetime import datetime, timedelta, timezone
+
+from sqlalchemy import case, func, select, tuple_
+from sqlalchemy.orm import Session
+
+from . import models
+from .cache import TTLCache
+
+ANALYTICS_TTL = float(os.getenv("ANALYTICS_CACHE_TTL", "60"))
+# Days of daily registration counts returned in the breakdown
+REGISTRATION_DAYS = 30
+
+_cache = TTLCache(ANALYTICS_TTL)
+
+
+def invalidate():
+    _cache.clear()
+
+
+def _age_band():
+    User = models.User
+    return case(
+        (User.age < 25, "18-24"),
+        (User.age < 30, "25-29"),
+        (User.age < 35, "30-34"),
+        (User.age < 40, "35-39"),
+        else_="40+"
+    )
+
+
+def _compute(db: Session, include_breakdowns: bool) -> dict:
+    User = models.User
+    seven_days_ago = datetime.now(timezone.utc) - timedelta(days=7)
+
+    totals = [
+        func.count().label("total_users"),
+        func.count().filter(User.is_verified == True).label("verified_users"),
+        func.count().filter(User.is_premium == True).label("premium_users"),
+        func.count().filter(User.is_verified == False).label("pending_verification"),
+        func.count().filter(User.created_at >= seven_days_ago).label("recent_registrations"),
+        func.count().filter(User.gender == 'male').label("male_users"),
+        func.count().filter(User.gender == 'female').label("female_users"),
+    ]
+    if not include_breakdowns:
+        row = db.execute(select(*totals)).one()
+        return dict(row._mapping)
+
+    age_band = _age_band()
+    day = func.date_trunc("day", User.created_at)
+    dimensions = {
+        "location": User.location,
+        "mother_tongue": User.mother_tongue,
+        "age_band": age_band,
+        "registrations_per_day": day,
+    }
+    stmt = select(
+        *totals,
+        *[column.label(name) for name, column in dimensions.items()],
+        *[func.grouping(column).label(f"grouping_{name}") for name, column in dimensions.items()]
+    ).group_by(func.grouping_sets(tuple_(), *[tuple_(column) for column in dimensions.values()]))
+
+    result = {}
+    breakdowns = {name: {} for name in dimensions}
+    for row in db.execute(stmt):
+        data = row._mapping
+        grouped_by = [name for name in dimensions if data[f"grouping_{name}"] == 0]
+        if not grouped_by:
+            # The () grouping set carries the overall totals
+            result = {column.name: data[column.name] for column in totals}
+            continue
+        name = grouped_by[0]
+        key = data[name]
+        if name == "registrations_per_day":
+            if key is None:
+                continue
+            key = key.date().isoformat()
+        breakdowns[name][key if key is not None else "unknown"] = data["total_users"]
+
+    cutoff = (datetime.now(timezone.utc) - timedelta(days=REGISTRATION_DAYS)).date().isoformat()
+    breakdowns["registrations_per_day"] = dict(sorted(
+        (day_key, count) for day_key, count in breakdowns["registrations_per_day"].items() if day_key >= cutoff
+    ))
+    result["breakdowns"] = breakdowns
+    return result
+
+
+def get_analytics(db: Session, include_breakdowns: bool = False) -> dict:
+    cached = _cache.get(include_breakdowns)
+    if cached is not None:
+        return cached
+    result = _compute(db, include_breakdowns)
+    _cache.set(include_breakdowns, result)
+    return result
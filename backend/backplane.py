@@ -0,0 +1,170 @@
+"""
+Pub/sub backplane for WebSocket fan-out.
+
+Each uvicorn worker only holds its own sockets, so events are published to a
+backplane and every worker delivers them to whichever matching sockets it has.
+Select the implementation with WS_BACKPLANE ("memory" or "postgres").
+With Postgres, envelopes too large for a NOTIFY payload are stored in
+backplane_payloads and the notification carries only their id.
+"""
+import asyncio
+import json
+import os
+from abc import ABC, abstractmethod
+from typing import Awaitable, Callable, Optional
+
+from sqlalchemy import text
+
+# Receives each event envelope on every worker
+DeliverCallback = Callable[[dict], Awaitable[None]]
+
+CHANNEL = os.getenv("WS_BACKPLANE_CHANNEL", "ws_events")
+
+# Postgres rejects NOTIFY payloads of 8000 bytes or more
+MAX_NOTIFY_PAYLOAD = 7900
+# Larger envelopes are parked in backplane_payloads for this long; listeners
+# fetch them by the id sent in the notification
+PAYLOAD_TTL = int(os.getenv("WS_BACKPLANE_PAYLOAD_TTL", "300"))
+REF_KEY = "payload_ref"
+
+STORE_PAYLOAD_SQL = text("""
+INSERT INTO backplane_payloads (envelope) VALUES (CAST(:envelope AS jsonb)) RETURNING id
+""")
+EXPIRE_PAYLOADS_SQL = text("""
+DELETE FROM backplane_payloads WHERE created_at < now() - make_interval(secs => :ttl)
+""")
+FETCH_PAYLOAD_SQL = text("SELECT envelope FROM backplane_payloads WHERE id = :id")
+
+
+class Backplane(ABC):
+    async def start(self, deliver: DeliverCallback):
+        self.deliver = deliver
+
+    async def stop(self):
+        pass
+
+    @abstractmethod
+    async def publish(self, envelope: dict):
+        """Send an envelope to every worker's deliver callback."""
+
+
+class InProcessBackplane(Backplane):
+    """Single-worker backplane: events are delivered straight to local sockets."""
+
+    async def publish(self, envelope: dict):
+        await self.deliver(envelope)
+
+
+class PostgresBackplane(Backplane):
+    """Cross-worker backplane built on Postgres LISTEN/NOTIFY."""
+
+    def __init__(self, engine, channel: str = CHANNEL):
+        self.engine = engine
+        self.channel = channel
+        self._listener = None
+        self._task: Optional[asyncio.Task] = None
+        self._consumer: Optional[asyncio.Task] = None
+        # Received envelopes, delivered one at a time so they keep their order
+        self._inbox: asyncio.Queue = asyncio.Queue()
+        self._lost = asyncio.Event()
+
+    async def start(self, deliver: DeliverCallback):
+        await super().start(deliver)
+        self._task = asyncio.create_task(self._listen_forever())
+        self._consumer = asyncio.create_task(self._consume())
+
+    async def stop(self):
+        for task in (self._task, self._consumer):
+            if task:
+                task.cancel()
+        self._close_listener()
+
+    async def publish(self, envelope: dict):
+        payload = json.dumps(envelope, default=str)
+        await asyncio.to_thread(self._notify, payload)
+
+    def _notify(self, payload: str):
+        with self.engine.connect() as conn:
+            if len(payload.encode("utf-8")) > MAX_NOTIFY_PAYLOAD:
+                # Too large for NOTIFY: store it and send a reference, committed
+                # together so listeners always find the row
+                payload_id = conn.execute(STORE_PAYLOAD_SQL, {"envelope": payload}).scalar()
+                conn.execute(EXPIRE_PAYLOADS_SQL, {"ttl": PAYLOAD_TTL})
+                payload = json.dumps({REF_KEY: payload_id})
+            conn.execute(text("SELECT pg_notify(:channel, :payload)"),
+                         {"channel": self.channel, "payload": payload})
+            conn.commit()
+
+    def _fetch(self, payload_id: int) -> Optional[dict]:
+        with self.engine.connect() as conn:
+            return conn.execute(FETCH_PAYLOAD_SQL, {"id": payload_id}).scalar()
+
+    async def _consume(self):
+        while True:
+            envelope = await self._inbox.get()
+            try:
+                if REF_KEY in envelope:
+                    payload_id = envelope[REF_KEY]
+                    envelope = await asyncio.to_thread(self._fetch, payload_id)
+                    if envelope is None:
+                        print(f"Backplane payload {payload_id} expired before delivery")
+                        continue
+                await self.deliver(envelope)
+            except Exception as e:
+                print(f"Error delivering backplane event: {e}")
+
+    async def _listen_forever(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            try:
+                # A dedicated connection outside the pool, in autocommit mode
+                pooled = self.engine.raw_connection()
+                pooled.detach()
+                self._listener = pooled.dbapi_connection
+                self._listener.autocommit = True
+                with self._listener.cursor() as cur:
+                    cur.execute(f'LISTEN "{self.channel}"')
+                self._lost.clear()
+                loop.add_reader(self._listener.fileno(), self._on_readable)
+                await self._lost.wait()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                print(f"Backplane listener error: {e}")
+            self._close_listener()
+            await asyncio.sleep(1)
+
+    def _on_readable(self):
+        try:
+            self._listener.poll()
+        except Exception as e:
+            print(f"Backplane connection lost: {e}")
+            self._lost.set()
+            return
+        while self._listener.notifies:
+            notify = self._listener.notifies.pop(0)
+            try:
+                envelope = json.loads(notify.payload)
+            except ValueError:
+                continue
+            self._inbox.put_nowait(envelope)
+
+    def _close_listener(self):
+        if self._listener is None:
+            return
+        try:
+            asyncio.get_running_loop().remove_reader(self._listener.fileno())
+        except Exception:
+            pass
+        try:
+            self._listener.close()
+        except Exception:
+            pass
+        self._listener = None
+
+
+def create_backplane(engine) -> Backplane:
+    kind = os.getenv("WS_BACKPLANE", "memory").lower()
+    if kind == "postgres":
+        return PostgresBackplane(engine)
+    return InProcessBackplane()
@@ -0,0 +1,63 @@
+"""
+Maintenance of the denormalized `conversations` inbox table.
+
+Every write to chat_messages goes through these helpers inside the caller's
+transaction, so the inbox never disagrees with the messages it summarizes.
+"""
+from sqlalchemy import case, func
+from sqlalchemy.dialects.postgresql import insert
+from sqlalchemy.orm import Session
+
+from . import models
+
+PREVIEW_LENGTH = 200
+
+
+def record_message(db: Session, message: models.ChatMessage):
+    """Upsert both participants' inbox rows for a newly added message."""
+    # The message row must exist before it can be referenced as last_message_id
+    db.flush()
+
+    preview = (message.text or "")[:PREVIEW_LENGTH]
+    # now() is the transaction timestamp, i.e. the same value the message's
+    # server-side default receives
+    sent_at = func.now()
+    # Rows are locked until commit: take them in a fixed order, so A->B and B->A
+    # sends running at the same time can't deadlock
+    for owner_id, partner_id in sorted(((message.sender_id, message.receiver_id),
+                                        (message.receiver_id, message.sender_id))):
+        unread = 1 if owner_id == message.receiver_id and not message.is_read else 0
+        stmt = insert(models.Conversation).values(
+            user_id=owner_id,
+            partner_id=partner_id,
+            last_message_id=message.id,
+            last_message=preview,
+            last_message_time=sent_at,
+            last_sender_id=message.sender_id,
+            unread_count=unread
+        )
+        table = models.Conversation.__table__
+        # Messages can commit out of order; only a newer message replaces the preview
+        is_newer = (table.c.last_message_time == None) | (stmt.excluded.last_message_time >= table.c.last_message_time)
+        stmt = stmt.on_conflict_do_update(
+            index_elements=[table.c.user_id, table.c.partner_id],
+            set_={
+                "last_message_id": case((is_newer, stmt.excluded.last_message_id), else_=table.c.last_message_id),
+                "last_message": case((is_newer, stmt.excluded.last_message), else_=table.c.last_message),
+                "last_message_time": case((is_newer, stmt.excluded.last_message_time), else_=table.c.last_message_time),
+                "last_sender_id": case((is_newer, stmt.excluded.last_sender_id), else_=table.c.last_sender_id),
+                "unread_count": table.c.unread_count + stmt.excluded.unread_count,
+            }
+        )
+        db.execute(stmt)
+        if owner_id == partner_id:
+            break
+
+
+def mark_read(db: Session, user_id: str, partner_id: str):
+    """Reset the unread counter after the user has read a conversation."""
+    db.query(models.Conversation).filter(
+        models.Conversation.user_id == user_id,
+        models.Conversation.partner_id == partner_id,
+        models.Conversation.unread_count != 0
+    ).update({"unread_count": 0}, synchronize_session=False)
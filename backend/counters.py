@@ -0,0 +1,67 @@
+"""
+Incrementally maintained per-user counters (the `user_stats` table).
+
+Handlers call adjust() in the same transaction as the interest/shortlist
+change it reflects, so the profile dashboard is a single primary-key read.
+Account deletion releases the user's interests and shortlists with release_user();
+scripts/rebuild_user_stats.py recomputes everything from source tables.
+"""
+from typing import Dict
+
+from sqlalchemy import func, text
+from sqlalchemy.dialects.postgresql import insert
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from . import models
+
+# Take a deleted user's interests and shortlists out of everyone else's
+# counters, before the cascade removes the rows
+RELEASE_USER_SQL = text("""
+UPDATE user_stats s SET
+    interests_received_pending = greatest(s.interests_received_pending - d.pending, 0),
+    interests_sent = greatest(s.interests_sent - d.sent, 0),
+    shortlisted_by = greatest(s.shortlisted_by - d.shortlisted, 0)
+FROM (
+    SELECT user_id, sum(pending) AS pending, sum(sent) AS sent, sum(shortlisted) AS shortlisted
+    FROM (
+        SELECT receiver_id AS user_id, 1 AS pending, 0 AS sent, 0 AS shortlisted
+        FROM interests WHERE sender_id = :user_id AND status = 'pending'
+        UNION ALL
+        SELECT sender_id, 0, 1, 0 FROM interests WHERE receiver_id = :user_id
+        UNION ALL
+        SELECT shortlisted_user_id, 0, 0, 1 FROM shortlists WHERE user_id = :user_id
+    ) r
+    GROUP BY user_id
+) d
+WHERE s.user_id = d.user_id AND s.user_id <> :user_id
+""")
+
+
+async def adjust(db: AsyncSession, user_id: str, **deltas: int):
+    """Add deltas to a user's counters, creating the row on first use."""
+    deltas = {name: delta for name, delta in deltas.items() if delta}
+    if not user_id or not deltas:
+        return
+    table = models.UserStats.__table__
+    stmt = insert(table).values(
+        user_id=user_id,
+        **{name: max(delta, 0) for name, delta in deltas.items()}
+    ).on_conflict_do_update(
+        index_elements=[table.c.user_id],
+        set_={name: func.greatest(table.c[name] + delta, 0) for name, delta in deltas.items()}
+    )
+    await db.execute(stmt)
+
+
+async def adjust_users(db: AsyncSession, changes: Dict[str, Dict[str, int]]):
+    """
+    adjust() for several users, in user_id order: the rows stay locked until
+    commit, so a fixed order keeps concurrent transactions from deadlocking.
+    """
+    for user_id in sorted(changes):
+        await adjust(db, user_id, **changes[user_id])
+
+
+async def release_user(db: AsyncSession, user_id: str):
+    """Adjust other users' counters for an account about to be deleted."""
+    await db.execute(RELEASE_USER_SQL, {"user_id": user_id})
@@ -0,0 +1,106 @@
+"""
+Bounded per-user log of real-time events, for replay on reconnect.
+
+Every user-targeted event the outbox dispatcher publishes is stamped with the
+user's next sequence number and kept in `user_events`, trimmed to the newest
+LOG_SIZE per user. Numbers come from the user's `user_event_seqs` row, which
+the dispatcher holds locked until it has published and committed, so each
+user's events are published in increasing seq order with no gaps. A client
+reconnecting to /ws/{user_id}?last_seq=N is sent the events after N before
+live ones.
+"""
+import json
+import os
+from collections import Counter
+from typing import Dict, List, Tuple
+
+from sqlalchemy import select, text
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from . import models
+
+LOG_SIZE = int(os.getenv("WS_EVENT_LOG_SIZE", "100"))
+
+# Reserve `count` numbers per user. Rows are locked in user_id order so
+# concurrent dispatchers can't deadlock; users that no longer exist get none.
+ALLOCATE_SQL = text("""
+INSERT INTO user_event_seqs AS s (user_id, last_seq)
+SELECT d.user_id, d.count
+FROM unnest(CAST(:user_ids AS text[]), CAST(:counts AS bigint[])) AS d(user_id, count)
+JOIN users u ON u.id = d.user_id
+ORDER BY d.user_id
+ON CONFLICT (user_id) DO UPDATE SET last_seq = s.last_seq + EXCLUDED.last_seq
+RETURNING s.user_id, s.last_seq
+""")
+
+APPEND_SQL = text("""
+INSERT INTO user_events (user_id, seq, message)
+SELECT d.user_id, d.seq, d.message
+FROM unnest(CAST(:user_ids AS text[]), CAST(:seqs AS bigint[]), CAST(:messages AS jsonb[]))
+    AS d(user_id, seq, message)
+ON CONFLICT DO NOTHING
+""")
+
+TRIM_SQL = text("""
+DELETE FROM user_events e
+USING (
+    SELECT user_id, seq, row_number() OVER (PARTITION BY user_id ORDER BY seq DESC) AS position
+    FROM user_events
+    WHERE user_id = ANY(CAST(:user_ids AS text[]))
+) old
+WHERE e.user_id = old.user_id AND e.seq = old.seq AND old.position > :log_size
+""")
+
+
+async def stamp(db: AsyncSession, envelopes: List[dict]):
+    """
+    Number the user-targeted envelopes (in list order) and log them, in the
+    dispatcher's transaction. Publish them before committing.
+    """
+    counts = Counter(e["user_id"] for e in envelopes if e.get("target") == "user")
+    if not counts:
+        return
+    result = await db.execute(ALLOCATE_SQL, {
+        "user_ids": list(counts),
+        "counts": list(counts.values()),
+    })
+    next_seq: Dict[str, int] = {user_id: last_seq - counts[user_id] for user_id, last_seq in result}
+    entries: List[Tuple[str, int, dict]] = []
+    for envelope in envelopes:
+        user_id = envelope.get("user_id")
+        if envelope.get("target") != "user" or user_id not in next_seq:
+            continue
+        next_seq[user_id] += 1
+        envelope["message"]["seq"] = next_seq[user_id]
+        entries.append((user_id, next_seq[user_id], envelope["message"]))
+    await db.execute(APPEND_SQL, {
+        "user_ids": [user_id for user_id, _, _ in entries],
+        "seqs": [seq for _, seq, _ in entries],
+        "messages": [json.dumps(message) for _, _, message in entries],
+    })
+    await db.execute(TRIM_SQL, {"user_ids": list(next_seq), "log_size": LOG_SIZE})
+
+
+async def replay(db: AsyncSession, user_id: str, after_seq: int) -> Tuple[List[dict], bool]:
+    """
+    Events for `user_id` after `after_seq`, oldest first, and whether they are
+    complete (False when some were already trimmed from the log, or the client's
+    position is unknown here).
+    """
+    # Waits while a dispatcher holds this user's seq row, so everything already
+    # published to live sockets is in the log; other users are not affected
+    last_seq = await db.scalar(
+        select(models.UserEventSeq.last_seq)
+        .where(models.UserEventSeq.user_id == user_id)
+        .with_for_update(read=True)
+    ) or 0
+    rows = (await db.execute(
+        select(models.UserEvent.seq, models.UserEvent.message).where(
+            models.UserEvent.user_id == user_id,
+            models.UserEvent.seq > after_seq
+        ).order_by(models.UserEvent.seq)
+    )).all()
+    await db.commit()
+    # Seqs are gapless, so the log is complete when it starts right after the client
+    complete = after_seq == last_seq or (after_seq < last_seq and bool(rows) and rows[0].seq == after_seq + 1)
+    return [message for _, message in rows], complete
@@ -0,0 +1,98 @@
+"""
+Streaming profile export for the admin panel.
+
+Rows are read through a server-side cursor (`yield_per`) and written out in
+chunks, so memory stays flat however many users are exported.
+"""
+import csv
+import io
+import json
+from typing import Iterator, List, Optional
+
+from sqlalchemy import select
+
+from . import models, schemas
+from .database import SessionLocal
+
+YIELD_PER = 1000
+# Rows serialized into each chunk sent to the client
+CHUNK_ROWS = 200
+
+EXPORT_COLUMNS = list(schemas.UserResponse.model_fields)
+MEDIA_TYPES = {
+    "ndjson": "application/x-ndjson",
+    "csv": "text/csv",
+}
+
+
+def parse_columns(columns: Optional[str]) -> List[str]:
+    """Comma separated column names; raises ValueError for unknown ones."""
+    if not columns:
+        return EXPORT_COLUMNS
+    selected = [c.strip() for c in columns.split(",") if c.strip()]
+    unknown = [c for c in selected if c not in schemas.UserResponse.model_fields]
+    if unknown:
+        raise ValueError(f"Unknown columns: {', '.join(unknown)}")
+    return selected
+
+
+def build_query(
+    include_inactive: bool = False,
+    gender: Optional[str] = None,
+    is_verified: Optional[bool] = None,
+    is_premium: Optional[bool] = None,
+):
+    query = select(models.User)
+    if not include_inactive:
+        query = query.where(models.User.is_active == True)
+    if gender:
+        query = query.where(models.User.gender == gender)
+    if is_verified is not None:
+        query = query.where(models.User.is_verified == is_verified)
+    if is_premium is not None:
+        query = query.where(models.User.is_premium == is_premium)
+    # Stable order so repeated exports line up
+    return query.order_by(models.User.created_at, models.User.id)
+
+
+def _rows(query, columns: List[str]) -> Iterator[dict]:
+    with SessionLocal() as db:
+        result = db.execute(query.execution_options(yield_per=YIELD_PER)).scalars()
+        for user in result:
+            yield schemas.UserResponse.model_validate(user).model_dump(mode="json", include=set(columns))
+
+
+def stream_ndjson(query, columns: List[str]) -> Iterator[str]:
+    lines = []
+    for row in _rows(query, columns):
+        lines.append(json.dumps({c: row[c] for c in columns}))
+        if len(lines) >= CHUNK_ROWS:
+            yield "\n".join(lines) + "\n"
+            lines = []
+    if lines:
+        yield "\n".join(lines) + "\n"
+
+
+def stream_csv(query, columns: List[str]) -> Iterator[str]:
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(columns)
+    count = 0
+    for row in _rows(query, columns):
+        # Lists (photos, languages) are kept as JSON inside their cell
+        writer.writerow([
+            json.dumps(row[c]) if isinstance(row[c], list) else row[c]
+            for c in columns
+        ])
+        count += 1
+        if count % CHUNK_ROWS == 0:
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+    yield buffer.getvalue()
+
+
+def stream_profiles(fmt: str, query, columns: List[str]) -> Iterator[str]:
+    if fmt == "csv":
+        return stream_csv(query, columns)
+    return stream_ndjson(query, columns)
@@ -0,0 +1,108 @@
+"""
+Resized image variants for uploaded photos.
+
+Each image under the uploads directory can be served in a few sizes
+(thumb, card, full), encoded as WebP (or JPEG with IMAGE_VARIANT_FORMAT=jpeg).
+Variants are generated in the background right after /upload, and on first
+request for files that predate the pipeline. They live under
+uploads/variants/<name>/ mirroring the original's path.
+"""
+import os
+import tempfile
+from typing import Dict, Optional
+
+from PIL import Image, ImageOps
+
+from . import storage
+
+# Longest edge in pixels
+VARIANTS = {
+    "thumb": 160,
+    "card": 480,
+    "full": 1280,
+}
+VARIANT_DIR = "variants"
+FORMAT = os.getenv("IMAGE_VARIANT_FORMAT", "webp").lower()
+QUALITY = int(os.getenv("IMAGE_VARIANT_QUALITY", "80"))
+IMAGE_EXTENSIONS = {".jpg", ".jpeg", ".png", ".webp", ".gif", ".bmp"}
+
+_EXTENSION = ".jpg" if FORMAT == "jpeg" else ".webp"
+_PIL_FORMAT = "JPEG" if FORMAT == "jpeg" else "WEBP"
+
+
+def source_path(url: Optional[str]) -> Optional[str]:
+    """Path of an uploaded image relative to the uploads directory, if `url` is one."""
+    if not url or not url.startswith("/uploads/"):
+        return None
+    relative = os.path.normpath(url[len("/uploads/"):])
+    if relative.startswith((".", "/", VARIANT_DIR + os.sep)):
+        return None
+    if os.path.splitext(relative)[1].lower() not in IMAGE_EXTENSIONS:
+        return None
+    return relative
+
+
+def variant_path(relative: str, variant: str) -> str:
+    return os.path.join(VARIANT_DIR, variant, os.path.splitext(relative)[0] + _EXTENSION)
+
+
+def variant_urls(url: Optional[str]) -> Optional[Dict[str, str]]:
+    """URLs of every variant of an uploaded image; None for anything else."""
+    relative = source_path(url)
+    if relative is None:
+        return None
+    return {name: f"/variants/{name}/{relative}" for name in VARIANTS}
+
+
+def _render(image: Image.Image, variant: str, destination: str):
+    size = VARIANTS[variant]
+    resized = image.copy()
+    resized.thumbnail((size, size), Image.LANCZOS)
+    if _PIL_FORMAT == "JPEG" and resized.mode != "RGB":
+        resized = resized.convert("RGB")
+    os.makedirs(os.path.dirname(destination), exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(destination), prefix=".variant-")
+    try:
+        with os.fdopen(fd, "wb") as out:
+            resized.save(out, _PIL_FORMAT, quality=QUALITY)
+        os.replace(tmp_path, destination)
+    except BaseException:
+        storage.remove_quietly(tmp_path)
+        raise
+
+
+def _open(relative: str, size: int) -> Image.Image:
+    image = Image.open(os.path.join(storage.UPLOAD_DIR, relative))
+    # Let the JPEG decoder downscale while decoding when only a small size is needed
+    image.draft("RGB", (size, size))
+    image = ImageOps.exif_transpose(image)
+    if image.mode not in ("RGB", "RGBA"):
+        image = image.convert("RGBA" if "transparency" in image.info else "RGB")
+    return image
+
+
+def generate_variants(url: str):
+    """Render every variant of an uploaded image (background task after /upload)."""
+    relative = source_path(url)
+    if relative is None:
+        return
+    try:
+        image = _open(relative, max(VARIANTS.values()))
+        # Largest first, so each resize works from the decoded original once
+        for name in sorted(VARIANTS, key=VARIANTS.get, reverse=True):
+            _render(image, name, os.path.join(storage.UPLOAD_DIR, variant_path(relative, name)))
+    except Exception as e:
+        print(f"Error generating image variants for {url}: {e}")
+
+
+def ensure_variant(relative: str, variant: str) -> str:
+    """Path of a variant on disk, rendering it first if it is missing."""
+    destination = os.path.join(storage.UPLOAD_DIR, variant_path(relative, variant))
+    if not os.path.exists(destination):
+        _render(_open(relative, VARIANTS[variant]), variant, destination)
+    return destination
+
+
+def remove_variants(relative: str):
+    for name in VARIANTS:
+        storage.remove_quietly(os.path.join(storage.UPLOAD_DIR, variant_path(relative, name)))
@@ -0,0 +1,182 @@
+"""
+Bulk profile import from CSV or NDJSON.
+
+Records are parsed and validated one at a time on a worker thread, so large
+files don't block the event loop. Passwords are hashed on the hashing pool in
+parallel, and valid rows are inserted in batches with ON CONFLICT DO NOTHING. Rows that fail validation or collide with an existing
+id/phone (or that the database rejects) are reported individually instead of
+aborting the import.
+"""
+import asyncio
+import csv
+import json
+from typing import Iterable, Iterator, List, Optional, Tuple
+
+from pydantic import ValidationError
+from sqlalchemy.dialects.postgresql import insert
+from sqlalchemy.exc import SQLAlchemyError
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from . import media, models, premium, schemas
+from .passwords import get_password_hash, hashing_pool
+
+BATCH_SIZE = 500
+# asyncpg allows at most 32767 bind parameters per statement, one per column per row
+MAX_BATCH_SIZE = 32767 // len(models.User.__table__.columns)
+LIST_FIELDS = ("languages", "photos")
+
+
+def detect_format(filename: Optional[str]) -> str:
+    if filename and filename.lower().endswith(".csv"):
+        return "csv"
+    return "ndjson"
+
+
+def _clean_csv_row(row: dict) -> dict:
+    record = {}
+    for key, value in row.items():
+        if key is None or value is None or value.strip() == "":
+            # Missing cells fall back to the schema defaults
+            continue
+        value = value.strip()
+        if key in LIST_FIELDS:
+            # Either a JSON array or a comma separated list
+            value = json.loads(value) if value.startswith("[") else [v.strip() for v in value.split(",") if v.strip()]
+        record[key] = value
+    return record
+
+
+def parse_records(lines: Iterable[str], fmt: str) -> Iterator[Tuple[int, object]]:
+    """Yields (row number, dict) or (row number, error message)."""
+    if fmt == "csv":
+        for number, row in enumerate(csv.DictReader(lines), start=2):
+            try:
+                yield number, _clean_csv_row(row)
+            except ValueError as e:
+                yield number, f"Invalid list value: {e}"
+        return
+    for number, line in enumerate(lines, start=1):
+        if not line.strip():
+            continue
+        try:
+            record = json.loads(line)
+        except ValueError as e:
+            yield number, f"Invalid JSON: {e}"
+            continue
+        if not isinstance(record, dict):
+            yield number, "Expected a JSON object"
+            continue
+        yield number, record
+
+
+def _format_errors(error: ValidationError) -> List[str]:
+    return [f"{'.'.join(str(p) for p in e['loc'])}: {e['msg']}" for e in error.errors()]
+
+
+async def _hash_passwords(rows: List[dict]):
+    # Keep at most `workers` jobs queued so interactive logins still get through
+    limit = asyncio.Semaphore(hashing_pool.workers)
+
+    async def hash_one(row):
+        password = row.pop("password", None)
+        row["password_hash"] = None
+        if password:
+            async with limit:
+                row["password_hash"] = await get_password_hash(password)
+
+    await asyncio.gather(*(hash_one(row) for row in rows))
+
+
+def _record_inserted(batch: List[Tuple[int, dict]], inserted: set, report: dict):
+    for number, row in batch:
+        if row["id"] in inserted:
+            # An id can only be inserted once; later duplicates in the file are conflicts
+            inserted.discard(row["id"])
+            report["imported"] += 1
+        else:
+            report["skipped"] += 1
+            report["errors"].append({
+                "row": number,
+                "id": row["id"],
+                "errors": ["User id or phone number already exists"],
+            })
+
+
+async def _insert_rows(db: AsyncSession, rows: List[dict]) -> set:
+    result = await db.execute(
+        insert(models.User).values(rows).on_conflict_do_nothing().returning(models.User.id)
+    )
+    inserted = set(result.scalars())
+    # Stored uploads the new profiles point at gain a reference, in the same
+    # transaction, so media GC never collects them
+    added, counted = [], set()
+    for row in rows:
+        if row["id"] in inserted and row["id"] not in counted:
+            # Only the first row with an id can have been inserted
+            counted.add(row["id"])
+            added += list(row.get("photos") or []) + [row.get("horoscope_image_url")]
+    await media.adjust_refs(db, added=added)
+    await db.commit()
+    return inserted
+
+
+async def _insert_batch(db: AsyncSession, batch: List[Tuple[int, dict]], report: dict):
+    rows = [row for _, row in batch]
+    await _hash_passwords(rows)
+    for row in rows:
+        row["premium_next_check_at"] = (
+            premium.next_check_at(row.get("premium_expiry_date"), row.get("last_premium_reminder"))
+            if row.get("is_premium") else None
+        )
+    try:
+        _record_inserted(batch, await _insert_rows(db, rows), report)
+        return
+    except SQLAlchemyError:
+        await db.rollback()
+    # A row the database rejected (e.g. a value too long for its column) fails
+    # the whole statement: retry one row at a time to report just that row
+    for number, row in batch:
+        try:
+            _record_inserted([(number, row)], await _insert_rows(db, [row]), report)
+        except SQLAlchemyError as e:
+            await db.rollback()
+            report["failed"] += 1
+            report["errors"].append({"row": number, "id": row["id"], "errors": [str(getattr(e, "orig", None) or e).strip()]})
+
+
+def _validated_batches(lines: Iterable[str], fmt: str, batch_size: int, report: dict) -> Iterator[List[Tuple[int, dict]]]:
+    """Parse and validate records, yielding batches of (row number, row) to insert."""
+    batch: List[Tuple[int, dict]] = []
+    for number, record in parse_records(lines, fmt):
+        if isinstance(record, str):
+            report["failed"] += 1
+            report["errors"].append({"row": number, "id": None, "errors": [record]})
+            continue
+        try:
+            user = schemas.UserCreate.model_validate(record)
+        except ValidationError as e:
+            report["failed"] += 1
+            report["errors"].append({"row": number, "id": record.get("id"), "errors": _format_errors(e)})
+            continue
+        batch.append((number, user.model_dump()))
+        if len(batch) >= batch_size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+async def import_profiles(db: AsyncSession, lines: Iterable[str], fmt: str, batch_size: int = BATCH_SIZE) -> dict:
+    """
+    Import profiles from `lines`. Returns a report with imported/skipped/failed
+    counts and one entry per row that was not imported.
+    """
+    report = {"imported": 0, "skipped": 0, "failed": 0, "errors": []}
+    batch_size = max(1, min(batch_size, MAX_BATCH_SIZE))
+    # Reading, parsing and validating run on a worker thread, one batch at a time
+    batches = _validated_batches(lines, fmt, batch_size, report)
+    while True:
+        batch = await asyncio.to_thread(next, batches, None)
+        if batch is None:
+            return report
+        await _insert_batch(db, batch, report)
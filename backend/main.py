@@ -1,19 +1,27 @@
-from fastapi import FastAPI, Depends, HTTPException, status, File, UploadFile, Form, WebSocket, WebSocketDisconnect
+from fastapi import FastAPI, Depends, HTTPException, status, File, UploadFile, Form, WebSocket, WebSocketDisconnect, Query, Request, BackgroundTasks
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import JSONResponse, StreamingResponse, FileResponse
 from fastapi.staticfiles import StaticFiles
 from sqlalchemy.orm import Session
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy import tuple_, select, delete, func
 from typing import List, Optional, Dict
 import uvicorn
+import io
 import os
-import shutil
 import uuid
 import asyncio
-from datetime import datetime, timedelta, timezone
+from datetime import datetime, timezone
 
-from . import models, schemas, database
-from .database import engine, get_db
+from . import models, schemas, database, matching, conversations, premium, analytics, counters, views, export, importer, storage, media, images, notifications, outbox, event_log, presence
+from .presence import PresenceRegistry, TypingTracker
+from .database import engine, get_db, get_async_db
+from .pagination import encode_cursor, decode_cursor
+from .backplane import Backplane, create_backplane
+from .passwords import get_password_hash, verify_password, hashing_pool, HashingPoolBusy
+from .views import view_buffer
+from .cache import LRUCache
 
-from passlib.context import CryptContext
 from pydantic import BaseModel
 
 # Create tables
@@ -22,8 +30,8 @@ models.Base.metadata.create_all(bind=engine)
 app = FastAPI(title="Mali Matrimony API", version="0.7.0")
 
 # Mount uploads directory to serve images
-os.makedirs("backend/uploads", exist_ok=True)
-app.mount("/uploads", StaticFiles(directory="backend/uploads"), name="uploads")
+os.makedirs(storage.UPLOAD_DIR, exist_ok=True)
+app.mount("/uploads", StaticFiles(directory=storage.UPLOAD_DIR), name="uploads")
 
 # Configure CORS
 app.add_middleware(
@@ -34,71 +42,181 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+# Outbound WebSocket queue settings
+WS_SEND_QUEUE_SIZE = int(os.getenv("WS_SEND_QUEUE_SIZE", "100"))
+WS_OVERFLOW_POLICY = os.getenv("WS_OVERFLOW_POLICY", "drop_oldest")  # or "disconnect"
+
+class ConnectionSender:
+    """
+    Bounded outbound queue for one socket, drained by its own writer task,
+    so a slow client never stalls the handler that produced the event.
+    """
+    def __init__(self, websocket: WebSocket, on_closed, replaying: bool = False):
+        self.websocket = websocket
+        self.queue: asyncio.Queue = asyncio.Queue(maxsize=WS_SEND_QUEUE_SIZE)
+        self.dropped = 0
+        self._on_closed = on_closed
+        # Live events are held back until missed ones have been replayed
+        self._held: Optional[List[dict]] = [] if replaying else None
+        # Replayed events, sent before the queue and outside its bound (the log
+        # already bounds them), so none of them is dropped
+        self._backlog: List[dict] = []
+        self._ready = asyncio.Event()
+        if not replaying:
+            self._ready.set()
+        self._writer = asyncio.create_task(self._drain())
+
+    def enqueue(self, message: dict):
+        if self._held is not None:
+            self._held.append(message)
+            return
+        self._put(message)
+
+    def finish_replay(self, missed: List[dict]):
+        """Send the replayed events, then the held live ones that were not among them."""
+        held, self._held = self._held or [], None
+        replayed = {message["seq"] for message in missed if "seq" in message}
+        self._backlog = list(missed)
+        for message in held:
+            if message.get("seq") not in replayed:
+                self._put(message)
+        self._ready.set()
+
+    def _put(self, message: dict):
+        try:
+            self.queue.put_nowait(message)
+        except asyncio.QueueFull:
+            if WS_OVERFLOW_POLICY == "disconnect":
+                print("Send queue full, disconnecting slow client")
+                self.close()
+                asyncio.create_task(self._close_socket(code=1013))
+                return
+            # drop_oldest: discard the stalest event to make room
+            self.queue.get_nowait()
+            self.queue.put_nowait(message)
+            self.dropped += 1
+
+    async def _drain(self):
+        try:
+            await self._ready.wait()
+            for message in self._backlog:
+                await self.websocket.send_json(message)
+            self._backlog = []
+            while True:
+                message = await self.queue.get()
+                await self.websocket.send_json(message)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            print(f"Error sending on websocket: {e}")
+            self._on_closed(self)
+
+    async def _close_socket(self, code: int):
+        try:
+            await self.websocket.close(code=code)
+        except Exception:
+            pass
+
+    def close(self):
+        self._writer.cancel()
+        self._on_closed(self)
+
 # WebSocket Connection Manager
 class ConnectionManager:
-    def __init__(self):
-        self.active_connections: Dict[str, List[WebSocket]] = {}
-        self.admin_connections: List[WebSocket] = []
+    def __init__(self, backplane: Backplane):
+        self.active_connections: Dict[str, List[ConnectionSender]] = {}
+        self.admin_connections: List[ConnectionSender] = []
+        self.backplane = backplane
 
-    async def connect(self, websocket: WebSocket, user_id: str):
+    async def connect(self, websocket: WebSocket, user_id: str, last_seq: Optional[int] = None) -> ConnectionSender:
         await websocket.accept()
+        replaying = last_seq is not None and not user_id.startswith("admin_")
+        sender = ConnectionSender(websocket, lambda s: self._remove(s, user_id), replaying)
         if user_id.startswith("admin_"):
-            self.admin_connections.append(websocket)
+            self.admin_connections.append(sender)
         else:
             if user_id not in self.active_connections:
                 self.active_connections[user_id] = []
-            self.active_connections[user_id].append(websocket)
+            self.active_connections[user_id].append(sender)
+        if replaying:
+            # Registered first, so nothing published meanwhile slips between replay and live
+            try:
+                async with database.AsyncSessionLocal() as db:
+                    missed, complete = await event_log.replay(db, user_id, last_seq)
+            except Exception as e:
+                print(f"Error replaying events for {user_id}: {e}")
+                missed, complete = [], False
+            if not complete:
+                # Too far behind the bounded log; the client must reload its state
+                missed = [{"type": "resync_required"}] + missed
+            sender.finish_replay(missed)
+        return sender
 
     def disconnect(self, websocket: WebSocket, user_id: str):
+        pool = self.admin_connections if user_id.startswith("admin_") else self.active_connections.get(user_id, [])
+        for sender in list(pool):
+            if sender.websocket is websocket:
+                sender.close()
+
+    def _remove(self, sender: ConnectionSender, user_id: str):
         if user_id.startswith("admin_"):
-            if websocket in self.admin_connections:
-                self.admin_connections.remove(websocket)
+            if sender in self.admin_connections:
+                self.admin_connections.remove(sender)
         else:
             if user_id in self.active_connections:
-                self.active_connections[user_id].remove(websocket)
+                if sender in self.active_connections[user_id]:
+                    self.active_connections[user_id].remove(sender)
                 if not self.active_connections[user_id]:
                     del self.active_connections[user_id]
 
-    async def broadcast_to_admins(self, message: dict):
-        to_remove = []
-        for connection in self.admin_connections:
-            try:
-                await connection.send_json(message)
-            except Exception as e:
-                print(f"Error broadcasting to admin: {e}")
-                to_remove.append(connection)
-        
-        for conn in to_remove:
-            if conn in self.admin_connections:
-                self.admin_connections.remove(conn)
-
-    async def send_personal_message(self, message: dict, user_id: str):
-        if user_id in self.active_connections:
-            to_remove = []
-            for connection in self.active_connections[user_id]:
-                try:
-                    await connection.send_json(message)
-                except Exception as e:
-                    print(f"Error sending to user {user_id}: {e}")
-                    to_remove.append(connection)
-            
-            for conn in to_remove:
-                if conn in self.active_connections[user_id]:
-                    self.active_connections[user_id].remove(conn)
-            
-            if not self.active_connections[user_id]:
-                del self.active_connections[user_id]
-
-manager = ConnectionManager()
-
-# Password hashing configuration
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
+    def broadcast_to_admins(self, message: dict, db):
+        # Written to the outbox in the caller's transaction; the dispatcher
+        # publishes it through the backplane once committed
+        outbox.add(db, {"target": "admins", "message": message})
+
+    def send_personal_message(self, message: dict, user_id: str, db):
+        outbox.add(db, {"target": "user", "user_id": user_id, "message": message})
+
+    async def send_ephemeral(self, message: dict, user_id: str):
+        """Publish right away, bypassing the outbox, for events with no database change."""
+        await self.backplane.publish({"target": "user", "user_id": user_id, "message": message})
+
+    async def deliver(self, envelope: dict):
+        """Backplane callback: queue an event for the matching sockets on this worker."""
+        if envelope.get("target") == "presence":
+            presence_registry.apply(envelope)
+            return
+        if envelope.get("target") == "admins":
+            targets = list(self.admin_connections)
+        elif envelope.get("target") == "user":
+            targets = list(self.active_connections.get(envelope["user_id"], []))
+        else:
+            return
+        # Enqueue only; each connection's writer task does the socket I/O
+        for sender in targets:
+            sender.enqueue(envelope["message"])
+
+manager = ConnectionManager(create_backplane(engine))
+presence_registry = PresenceRegistry()
+typing_tracker = TypingTracker()
+# How often stale typing states and heartbeats are checked
+PRESENCE_SWEEP_INTERVAL = float(os.getenv("PRESENCE_SWEEP_INTERVAL", "0.5"))
+
+# Serialized GET /profiles/{user_id} payloads for hot profiles. Invalidated by every
+# handler that changes a user; the TTL bounds staleness across workers.
+profile_cache = LRUCache(
+    maxsize=int(os.getenv("PROFILE_CACHE_SIZE", "5000")),
+    ttl=float(os.getenv("PROFILE_CACHE_TTL", "60"))
+)
 
-def verify_password(plain_password, hashed_password):
-    return pwd_context.verify(plain_password, hashed_password)
+# Password hashing runs on a bounded pool (see passwords.py); shed load when it is full
+@app.exception_handler(HashingPoolBusy)
+async def hashing_pool_busy_handler(request: Request, exc: HashingPoolBusy):
+    return JSONResponse(status_code=503, content={"detail": "Server busy, please try again shortly"})
 
-def get_password_hash(password):
-    return pwd_context.hash(password)
+@app.exception_handler(storage.UploadTooLarge)
+async def upload_too_large_handler(request: Request, exc: storage.UploadTooLarge):
+    return JSONResponse(status_code=413, content={"detail": str(exc)})
 
 # OTP Models (since simple, defining here or move to schemas)
 class OTPRequest(BaseModel):
@@ -111,103 +229,145 @@ class OTPVerify(BaseModel):
 # In-memory OTP store (for demo purposes)
 otp_store = {}
 
+# Set whenever a premium schedule changes so the scheduler re-plans its sleep
+premium_schedule_changed = asyncio.Event()
+PREMIUM_MAX_SLEEP = int(os.getenv("PREMIUM_MAX_SLEEP", "900"))
+
 async def check_premium_expiries():
     """
-    Background task to check for premium expiries and send reminders.
-    Runs every hour.
+    Background task sending premium reminders and downgrading expired members.
+    Only users whose premium_next_check_at has passed are processed, in bulk
+    batches, and the task sleeps until the next one is due. An advisory lock
+    keeps concurrent workers from processing the same batch.
     """
     while True:
+        next_due = None
         try:
-            db = database.SessionLocal()
-            now = datetime.now(timezone.utc)
-            
-            # Find all premium users
-            premium_users = db.query(models.User).filter(
-                models.User.is_premium == True,
-                models.User.premium_expiry_date != None
-            ).all()
-            
-            for user in premium_users:
-                expiry = user.premium_expiry_date
-                time_left = expiry - now
-                
-                reminder_type = None
-                message = None
-                
-                # Expiry Check
-                if time_left.total_seconds() <= 0:
-                    # Downgrade user
-                    user.is_premium = False
-                    user.premium_expiry_date = None
-                    user.last_premium_reminder = 'expired'
-                    
-                    # Notify user
-                    new_notif = models.Notification(
-                        id=str(uuid.uuid4()),
-                        user_id=user.id,
-                        title="Premium Membership Expired",
-                        message="Your premium membership has expired. Upgrade now to continue enjoying premium benefits!",
-                        type="system"
-                    )
-                    db.add(new_notif)
-                    
-                    # Push real-time update
-                    await manager.send_personal_message(
-                        {"type": "profile_updated", "user_id": user.id},
-                        user.id
-                    )
-                
-                # Reminder Checks (only if not already sent for this interval)
-                elif time_left <= timedelta(days=1) and user.last_premium_reminder != '1d':
-                    reminder_type = '1d'
-                    message = "Your premium membership expires in 1 day! Renew now to stay premium."
-                elif time_left <= timedelta(days=2) and user.last_premium_reminder not in ['1d', '2d']:
-                    reminder_type = '2d'
-                    message = "Your premium membership expires in 2 days. Don't forget to renew!"
-                elif time_left <= timedelta(days=3) and user.last_premium_reminder not in ['1d', '2d', '3d']:
-                    reminder_type = '3d'
-                    message = "Your premium membership expires in 3 days. Renew now!"
-                elif time_left <= timedelta(days=7) and user.last_premium_reminder not in ['1d', '2d', '3d', '7d']:
-                    reminder_type = '7d'
-                    message = "Your premium membership expires in 1 week."
-                elif time_left <= timedelta(days=14) and user.last_premium_reminder not in ['1d', '2d', '3d', '7d', '14d']:
-                    reminder_type = '14d'
-                    message = "Your premium membership expires in 2 weeks."
-                elif time_left <= timedelta(days=30) and user.last_premium_reminder not in ['1d', '2d', '3d', '7d', '14d', '30d']:
-                    reminder_type = '30d'
-                    message = "Your premium membership expires in 1 month. Plan ahead!"
-                
-                if reminder_type and message:
-                    user.last_premium_reminder = reminder_type
-                    new_notif = models.Notification(
-                        id=str(uuid.uuid4()),
-                        user_id=user.id,
-                        title="Premium Renewal Reminder",
-                        message=message,
-                        type="system"
-                    )
-                    db.add(new_notif)
-                    
-                    # Push real-time update
-                    await manager.send_personal_message(
-                        {"type": "new_notification", "title": "Premium Renewal Reminder"},
-                        user.id
-                    )
-            
-            db.commit()
-            db.close()
-            
+            async with database.AsyncSessionLocal() as db:
+                while True:
+                    result = await premium.process_due_batch(db, datetime.now(timezone.utc))
+                    if result is None:
+                        # Another worker holds the scheduler lock
+                        await db.rollback()
+                        break
+                    processed, pushes = result
+                    for user_id, payload in pushes:
+                        manager.send_personal_message(payload, user_id, db)
+                    await db.commit()
+
+                    for user_id, _ in pushes:
+                        profile_cache.invalidate(user_id)
+
+                    if processed < premium.BATCH_SIZE:
+                        break
+                next_due = await premium.next_due_at(db)
         except Exception as e:
             print(f"Error in premium expiry check task: {e}")
-            
-        # Wait for 1 hour before next check
-        # For testing purposes, you could reduce this, but 1 hour is reasonable for production.
-        await asyncio.sleep(3600)
+
+        # Sleep until the next reminder/expiry is due (capped so schedule changes
+        # made on other workers are picked up too)
+        timeout = PREMIUM_MAX_SLEEP
+        if next_due is not None:
+            timeout = min(max((next_due - datetime.now(timezone.utc)).total_seconds(), 1), PREMIUM_MAX_SLEEP)
+        try:
+            await asyncio.wait_for(premium_schedule_changed.wait(), timeout)
+        except asyncio.TimeoutError:
+            pass
+        premium_schedule_changed.clear()
+
+async def flush_views_once():
+    # "Profile Viewed" pushes go through the outbox inside the flush transaction
+    async with database.AsyncSessionLocal() as db:
+        flushed_users = await view_buffer.flush(db)
+    # Cached payloads still carry the pre-flush view_count
+    for owner_id in flushed_users:
+        profile_cache.invalidate(owner_id)
+
+async def flush_profile_views():
+    """Background task writing buffered profile views in batches."""
+    while True:
+        await asyncio.sleep(views.FLUSH_INTERVAL)
+        try:
+            await flush_views_once()
+        except Exception as e:
+            print(f"Error flushing profile views: {e}")
+
+async def collect_media_garbage():
+    """
+    Background task deleting stored uploads that nothing references any more.
+    An advisory lock lets only one worker collect at a time.
+    """
+    loop = asyncio.get_running_loop()
+    last_reconcile = loop.time()
+    while True:
+        await asyncio.sleep(media.GC_INTERVAL)
+        try:
+            reconcile = bool(media.GC_RECONCILE_INTERVAL) and loop.time() - last_reconcile >= media.GC_RECONCILE_INTERVAL
+            result = await media.gc_exclusive(reconcile)
+            if result is None:
+                continue
+            if reconcile:
+                last_reconcile = loop.time()
+            if result["removed"]:
+                print(f"Media GC removed {result['removed']} unreferenced files")
+        except Exception as e:
+            print(f"Error in media garbage collection: {e}")
+
+async def compact_notifications():
+    """Background task pruning old read notifications in bounded batches."""
+    while True:
+        await asyncio.sleep(notifications.COMPACTION_INTERVAL)
+        try:
+            async with database.AsyncSessionLocal() as db:
+                removed = await notifications.compact(db)
+            if removed:
+                print(f"Notification compaction removed {removed} read notifications")
+        except Exception as e:
+            print(f"Error compacting notifications: {e}")
+
+async def publish_presence(envelope: Optional[dict]):
+    if envelope is not None:
+        await manager.backplane.publish(envelope)
+
+async def sweep_presence():
+    """Background task sending debounced/expired typing stops and maintaining presence."""
+    last_announce = 0.0
+    while True:
+        await asyncio.sleep(PRESENCE_SWEEP_INTERVAL)
+        try:
+            for sender_id, receiver_id in typing_tracker.due():
+                await manager.send_ephemeral({"type": "typing_stopped", "sender_id": sender_id}, receiver_id)
+
+            now = asyncio.get_running_loop().time()
+            if now - last_announce >= presence.PRESENCE_ANNOUNCE_INTERVAL:
+                last_announce = now
+                await publish_presence(presence_registry.expire_stale())
+                for envelope in presence_registry.snapshots():
+                    await publish_presence(envelope)
+                presence_registry.prune()
+        except Exception as e:
+            print(f"Error sweeping presence: {e}")
 
 @app.on_event("startup")
 async def startup_event():
-    # Start background task
+    # Start WebSocket fan-out before anything can publish events
+    await manager.backplane.start(manager.deliver)
+    # Start background tasks
     asyncio.create_task(check_premium_expiries())
+    asyncio.create_task(flush_profile_views())
+    asyncio.create_task(collect_media_garbage())
+    asyncio.create_task(compact_notifications())
+    asyncio.create_task(outbox.run_dispatcher(manager.backplane.publish))
+    asyncio.create_task(sweep_presence())
+
+@app.on_event("shutdown")
+async def shutdown_event():
+    # Don't lose views buffered since the last flush
+    try:
+        await flush_views_once()
+    except Exception as e:
+        print(f"Error flushing profile views: {e}")
+    await manager.backplane.stop()
 
 @app.get("/")
 def read_root():
@@ -219,30 +379,46 @@ def ping():
 
 
 @app.websocket("/ws/{user_id}")
-async def websocket_endpoint(websocket: WebSocket, user_id: str):
-    await manager.connect(websocket, user_id)
-    
-    # Notify others that user is online (Optimization: Broadcast only to relevant users in future)
-    # For now, we skip broad 'online' broadcast to avoid noise, 
-    # relying on specific status checks or implement if requested.
+async def websocket_endpoint(websocket: WebSocket, user_id: str, last_seq: Optional[int] = None):
+    # Clients pass the last event "seq" they saw to receive what they missed
+    sender = await manager.connect(websocket, user_id, last_seq)
+    # Admin dashboards don't show up in presence
+    tracked = not user_id.startswith("admin_")
+    if tracked:
+        await publish_presence(presence_registry.connected(user_id))
     
     try:
         while True:
-            # Expect JSON messages for events like typing
+            # Expect JSON messages for heartbeats and events like typing
             data = await websocket.receive_json()
+            # Any frame counts as a heartbeat; a ping opts the socket into the timeout
+            if tracked:
+                await publish_presence(presence_registry.heartbeat(user_id, ping=data.get('type') == 'ping'))
             
-            # Handle Typing Events
-            if data.get('type') in ['typing_started', 'typing_stopped']:
+            if data.get('type') == 'ping':
+                sender.enqueue({"type": "pong"})
+            
+            # Handle Typing Events, coalesced per (sender, receiver)
+            elif data.get('type') in ['typing_started', 'typing_stopped']:
                 receiver_id = data.get('receiver_id')
                 if receiver_id:
-                    # Forward the event to the receiver
-                    await manager.send_personal_message({
-                        "type": data['type'],
-                        "sender_id": user_id
-                    }, receiver_id)
+                    if data['type'] == 'typing_stopped':
+                        # Sent by sweep_presence unless typing resumes within the debounce window
+                        typing_tracker.stopped(user_id, receiver_id)
+                    elif typing_tracker.started(user_id, receiver_id):
+                        await manager.send_ephemeral({
+                            "type": "typing_started",
+                            "sender_id": user_id
+                        }, receiver_id)
                     
     except WebSocketDisconnect:
         manager.disconnect(websocket, user_id)
+    finally:
+        if tracked:
+            await publish_presence(presence_registry.disconnected(user_id))
+        if not presence_registry.connected_here(user_id):
+            for receiver_id in typing_tracker.clear_sender(user_id):
+                await manager.send_ephemeral({"type": "typing_stopped", "sender_id": user_id}, receiver_id)
 
 # ==================== User Auth API ====================
 
@@ -287,69 +463,162 @@ def verify_otp_login(request: OTPVerify, db: Session = Depends(get_db)):
 
 
 @app.post("/upload", response_model=schemas.ApiResponse)
-async def upload_file(file: UploadFile = File(...)):
-    # Generate unique filename
-    file_extension = os.path.splitext(file.filename)[1]
-    unique_filename = f"{uuid.uuid4()}{file_extension}"
-    file_path = f"backend/uploads/{unique_filename}"
-    
-    # Save file
-    with open(file_path, "wb") as buffer:
-        shutil.copyfileobj(file.file, buffer)
+async def upload_file(background_tasks: BackgroundTasks, file: UploadFile = File(...), db: AsyncSession = Depends(get_async_db)):
+    # Streamed to disk in chunks off the event loop (see storage.py), then
+    # stored once per content hash (see media.py)
+    staged = await storage.stage_upload(file)
+    file_url = await media.store(db, staged)
+    # Resized variants are rendered after the response is sent
+    background_tasks.add_task(images.generate_variants, file_url)
     
     # Return the accessible URL
     # Note: In a real setup, this would be your domain or local IP
-    file_url = f"/uploads/{unique_filename}"
-    
     return schemas.ApiResponse(
         status="success",
         message="File uploaded successfully",
-        data={"url": file_url}
+        data={"url": file_url, "size": staged.size, "sha256": staged.sha256, "variants": images.variant_urls(file_url)}
     )
 
+@app.get("/variants/{variant}/{path:path}")
+def get_image_variant(variant: str, path: str):
+    # Variants missing for files uploaded before the pipeline are rendered on first request
+    relative = images.source_path(f"/uploads/{path}")
+    if variant not in images.VARIANTS or relative is None:
+        raise HTTPException(status_code=404, detail="Image not found")
+    if not os.path.exists(os.path.join(storage.UPLOAD_DIR, relative)):
+        raise HTTPException(status_code=404, detail="Image not found")
+    try:
+        variant_file = images.ensure_variant(relative, variant)
+    except OSError:
+        raise HTTPException(status_code=415, detail="Unsupported image")
+    return FileResponse(variant_file, headers={"Cache-Control": "public, max-age=31536000, immutable"})
+
 # ==================== Admin Auth API ====================
 
 @app.post("/admin/login", response_model=schemas.ApiResponse)
-def admin_login(creds: schemas.AdminLogin, db: Session = Depends(get_db)):
-    admin = db.query(models.Admin).filter(models.Admin.username == creds.username).first()
+async def admin_login(creds: schemas.AdminLogin, db: AsyncSession = Depends(get_async_db)):
+    admin = await db.scalar(select(models.Admin).where(models.Admin.username == creds.username))
     if not admin:
         raise HTTPException(status_code=401, detail="Invalid admin credentials")
     
-    if not verify_password(creds.password, admin.password_hash):
+    is_valid, new_hash = await verify_password(creds.password, admin.password_hash)
+    if not is_valid:
         raise HTTPException(status_code=401, detail="Invalid admin credentials")
     
+    # Upgrade hashes created with an older cost factor
+    if new_hash:
+        admin.password_hash = new_hash
+        await db.commit()
+    
     return schemas.ApiResponse(
         status="success",
         message="Admin login successful",
         data=schemas.AdminResponse.model_validate(admin).model_dump()
     )
 
+@app.get("/admin/hashing-pool", response_model=schemas.ApiResponse)
+def get_hashing_pool_status():
+    return schemas.ApiResponse(
+        status="success",
+        message="Password hashing pool status",
+        data=hashing_pool.metrics()
+    )
+
+@app.get("/admin/profile-cache", response_model=schemas.ApiResponse)
+def get_profile_cache_status():
+    return schemas.ApiResponse(
+        status="success",
+        message="Profile cache status",
+        data=profile_cache.stats()
+    )
+
+@app.get("/admin/db-pool", response_model=schemas.ApiResponse)
+def get_db_pool_status():
+    # Checked-out/idle connections, checkout wait times and overflow events
+    return schemas.ApiResponse(
+        status="success",
+        message="Database pool status",
+        data=database.pool_status()
+    )
+
+@app.get("/admin/profiles/export")
+def export_profiles(
+    format: str = Query("ndjson", pattern="^(ndjson|csv)$"),
+    columns: Optional[str] = None,
+    include_inactive: bool = False,
+    gender: Optional[str] = None,
+    is_verified: Optional[bool] = None,
+    is_premium: Optional[bool] = None,
+):
+    # Streamed through a server-side cursor; the session lives as long as the stream
+    try:
+        selected = export.parse_columns(columns)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    query = export.build_query(include_inactive, gender, is_verified, is_premium)
+    return StreamingResponse(
+        export.stream_profiles(format, query, selected),
+        media_type=export.MEDIA_TYPES[format],
+        headers={"Content-Disposition": f'attachment; filename="profiles.{format}"'}
+    )
+
+@app.post("/admin/profiles/import", response_model=schemas.ApiResponse)
+async def import_profiles(
+    file: UploadFile = File(...),
+    format: Optional[str] = Query(None, pattern="^(ndjson|csv)$"),
+    db: AsyncSession = Depends(get_async_db)
+):
+    # Rows are validated as they are read and inserted in batches; bad rows
+    # end up in the report instead of failing the whole upload
+    lines = io.TextIOWrapper(file.file, encoding="utf-8-sig", newline="")
+    report = await importer.import_profiles(db, lines, format or importer.detect_format(file.filename))
+    if report["imported"]:
+        analytics.invalidate()
+        # Imported premium members may have reminders due already
+        premium_schedule_changed.set()
+        manager.broadcast_to_admins({
+            "type": "users_imported",
+            "count": report["imported"],
+            "timestamp": datetime.now(timezone.utc).isoformat()
+        }, db)
+        await db.commit()
+    return schemas.ApiResponse(
+        status="success",
+        message=f"Imported {report['imported']} profiles",
+        data=report
+    )
+
 # ==================== User Auth API ====================
 
 @app.post("/auth/register", response_model=schemas.ApiResponse)
-async def register_user(user: schemas.UserCreate, db: Session = Depends(get_db)):
-    db_user = db.query(models.User).filter(models.User.id == user.id).first()
+async def register_user(user: schemas.UserCreate, db: AsyncSession = Depends(get_async_db)):
+    db_user = await db.get(models.User, user.id)
     if db_user:
         raise HTTPException(status_code=400, detail="User already registered")
     
+    user_dict = user.model_dump()
+    password = user_dict.pop('password', None)
+    if password:
+        user_dict['password_hash'] = await get_password_hash(password)
+    
     try:
-        user_dict = user.model_dump()
-        password = user_dict.pop('password', None)
-        if password:
-            user_dict['password_hash'] = get_password_hash(password)
-        
         new_user = models.User(**user_dict)
+        premium.schedule(new_user)
         db.add(new_user)
-        db.commit()
-        db.refresh(new_user)
+        await media.adjust_refs(db, added=media.user_media(new_user))
         
         # Notify Admins: Real-time user registration
-        await manager.broadcast_to_admins({
+        manager.broadcast_to_admins({
             "type": "user_registered",
             "user_id": new_user.id,
             "user_name": new_user.name,
             "timestamp": datetime.now(timezone.utc).isoformat()
-        })
+        }, db)
+        await db.commit()
+        await db.refresh(new_user)
+        analytics.invalidate()
+        if new_user.premium_next_check_at is not None:
+            premium_schedule_changed.set()
         
         return schemas.ApiResponse(
             status="success",
@@ -357,7 +626,7 @@ async def register_user(user: schemas.UserCreate, db: Session = Depends(get_db))
             data=schemas.UserResponse.model_validate(new_user).model_dump()
         )
     except Exception as e:
-        db.rollback()
+        await db.rollback()
         # Check for unique constraint violation (like phone number)
         error_str = str(e).lower()
         if "unique constraint" in error_str or "duplicate key" in error_str:
@@ -369,15 +638,20 @@ async def register_user(user: schemas.UserCreate, db: Session = Depends(get_db))
         raise HTTPException(status_code=500, detail=f"Internal server error: {str(e)}")
 
 @app.post("/auth/login", response_model=schemas.ApiResponse)
-def login_user(login_data: schemas.UserLogin, db: Session = Depends(get_db)):
-    user = db.query(models.User).filter(models.User.phone == login_data.phone).first()
+async def login_user(login_data: schemas.UserLogin, db: AsyncSession = Depends(get_async_db)):
+    user = await db.scalar(select(models.User).where(models.User.phone == login_data.phone))
     if not user:
         raise HTTPException(status_code=404, detail="User not found")
     
     # If user has a password, verify it
     if user.password_hash:
-        if not verify_password(login_data.password, user.password_hash):
+        is_valid, new_hash = await verify_password(login_data.password, user.password_hash)
+        if not is_valid:
             raise HTTPException(status_code=401, detail="Invalid password")
+        # Upgrade hashes created with an older cost factor
+        if new_hash:
+            user.password_hash = new_hash
+            await db.commit()
     
     return schemas.ApiResponse(
         status="success",
@@ -388,40 +662,9 @@ def login_user(login_data: schemas.UserLogin, db: Session = Depends(get_db)):
 # ==================== Analytics API ====================
 
 @app.get("/analytics", response_model=schemas.AnalyticsResponse)
-def get_analytics(db: Session = Depends(get_db)):
-
-    
-    # Total users
-    total_users = db.query(models.User).count()
-    
-    # Verified users
-    verified_users = db.query(models.User).filter(models.User.is_verified == True).count()
-    
-    # Premium users
-    premium_users = db.query(models.User).filter(models.User.is_premium == True).count()
-    
-    # Pending verification (not verified)
-    pending_verification = db.query(models.User).filter(models.User.is_verified == False).count()
-    
-    # Recent registrations (last 7 days)
-    seven_days_ago = datetime.now(timezone.utc) - timedelta(days=7)
-    recent_registrations = db.query(models.User).filter(
-        models.User.created_at >= seven_days_ago
-    ).count()
-    
-    # Gender distribution
-    male_users = db.query(models.User).filter(models.User.gender == 'male').count()
-    female_users = db.query(models.User).filter(models.User.gender == 'female').count()
-    
-    return schemas.AnalyticsResponse(
-        total_users=total_users,
-        verified_users=verified_users,
-        premium_users=premium_users,
-        pending_verification=pending_verification,
-        recent_registrations=recent_registrations,
-        male_users=male_users,
-        female_users=female_users
-    )
+def get_analytics(include_breakdowns: bool = False, db: Session = Depends(get_db)):
+    # Single aggregate query, served from a short-lived cache (see analytics.py)
+    return schemas.AnalyticsResponse(**analytics.get_analytics(db, include_breakdowns))
 
 # ==================== Profile API ====================
 
@@ -438,87 +681,181 @@ def get_all_profiles(include_inactive: bool = False, db: Session = Depends(get_d
         data=user_data
     )
 
+@app.get("/profiles/search", response_model=schemas.ApiResponse)
+def search_profiles(
+    gender: Optional[str] = None,
+    min_age: Optional[int] = None,
+    max_age: Optional[int] = None,
+    min_height: Optional[float] = None,
+    max_height: Optional[float] = None,
+    marital_status: Optional[str] = None,
+    caste: Optional[str] = None,
+    sub_caste: Optional[str] = None,
+    mother_tongue: Optional[str] = None,
+    location: Optional[str] = None,
+    education: Optional[str] = None,
+    is_verified: Optional[bool] = None,
+    is_premium: Optional[bool] = None,
+    exclude_user_id: Optional[str] = None,
+    cursor: Optional[str] = None,
+    limit: int = Query(20, ge=1, le=100),
+    db: Session = Depends(get_db)
+):
+    # Filters run in the database; only visible, active profiles are returned.
+    query = db.query(models.User).filter(
+        models.User.is_active == True,
+        models.User.is_hidden == False
+    )
+
+    if gender:
+        query = query.filter(models.User.gender == gender)
+    if min_age is not None:
+        query = query.filter(models.User.age >= min_age)
+    if max_age is not None:
+        query = query.filter(models.User.age <= max_age)
+    if min_height is not None:
+        query = query.filter(models.User.height >= min_height)
+    if max_height is not None:
+        query = query.filter(models.User.height <= max_height)
+    if marital_status:
+        query = query.filter(models.User.marital_status == marital_status)
+    if caste:
+        query = query.filter(models.User.caste == caste)
+    if sub_caste:
+        query = query.filter(models.User.sub_caste == sub_caste)
+    if mother_tongue:
+        query = query.filter(models.User.mother_tongue == mother_tongue)
+    if location:
+        query = query.filter(models.User.location == location)
+    if education:
+        query = query.filter(models.User.education == education)
+    if is_verified is not None:
+        query = query.filter(models.User.is_verified == is_verified)
+    if is_premium is not None:
+        query = query.filter(models.User.is_premium == is_premium)
+    if exclude_user_id:
+        query = query.filter(models.User.id != exclude_user_id)
+
+    # Keyset pagination on (created_at, id), newest first
+    if cursor:
+        try:
+            cursor_time, cursor_id = decode_cursor(cursor)
+        except ValueError:
+            raise HTTPException(status_code=400, detail="Invalid cursor")
+        query = query.filter(
+            tuple_(models.User.created_at, models.User.id) < tuple_(cursor_time, cursor_id)
+        )
+
+    # Fetch one extra row to know whether another page exists
+    users = query.order_by(
+        models.User.created_at.desc(),
+        models.User.id.desc()
+    ).limit(limit + 1).all()
+
+    has_more = len(users) > limit
+    users = users[:limit]
+    next_cursor = encode_cursor(users[-1].created_at, users[-1].id) if has_more else None
+
+    return schemas.ApiResponse(
+        status="success",
+        message="Profiles fetched successfully",
+        data={
+            "profiles": [schemas.UserResponse.model_validate(u).model_dump() for u in users],
+            "next_cursor": next_cursor
+        }
+    )
+
 @app.get("/profiles/{user_id}", response_model=schemas.ApiResponse)
-async def get_profile(user_id: str, viewer_id: Optional[str] = None, db: Session = Depends(get_db)):
-    user = db.query(models.User).filter(models.User.id == user_id).first()
-    if not user:
-        raise HTTPException(status_code=404, detail="Profile not found")
+async def get_profile(user_id: str, viewer_id: Optional[str] = None, db: AsyncSession = Depends(get_async_db)):
+    cached = profile_cache.get(user_id)
+    if cached is None:
+        user = await db.get(models.User, user_id)
+        if not user:
+            raise HTTPException(status_code=404, detail="Profile not found")
+        cached = schemas.UserResponse.model_validate(user).model_dump()
+        profile_cache.set(user_id, cached)
     
-    # If there's a viewer and they are not viewing their own profile
+    # If there's a viewer and they are not viewing their own profile, buffer the
+    # view; counts and "Profile Viewed" notifications are written by flush_profile_views.
+    # Only existing viewers count, as the flush would discard the rest anyway.
     if viewer_id and viewer_id != user_id:
-        viewer = db.query(models.User).filter(models.User.id == viewer_id).first()
-        if viewer:
-            # Increment view count
-            user.view_count += 1
-            
-            # Check if viewer has already notified this user (Deduplication)
-            existing_notif = db.query(models.Notification).filter(
-                models.Notification.user_id == user_id,
-                models.Notification.type == "profileView",
-                models.Notification.related_user_id == viewer_id
-            ).first()
-
-            if not existing_notif:
-                # Create notification for the profile owner
-                new_notif = models.Notification(
-                    id=str(uuid.uuid4()),
-                    user_id=user_id,
-                    title="Profile Viewed",
-                    message=f"{viewer.name} viewed your profile!",
-                    type="profileView",
-                    related_user_id=viewer_id
-                )
-                db.add(new_notif)
-                
-                # Push real-time update
-                await manager.send_personal_message(
-                    {"type": "new_notification", "title": "Profile Viewed"},
-                    user_id
-                )
-            
-            db.commit()
+        if await db.scalar(select(models.User.id).where(models.User.id == viewer_id)):
+            view_buffer.record(user_id, viewer_id)
     
+    # Copy so the cached payload itself is never modified
+    profile = dict(cached)
+    profile["view_count"] += view_buffer.pending_views(user_id)
     return schemas.ApiResponse(
         status="success",
         message="Profile fetched",
-        data=schemas.UserResponse.model_validate(user).model_dump()
+        data=profile
     )
 
 @app.get("/profiles/{user_id}/analytics", response_model=schemas.ApiResponse)
-async def get_user_analytics(user_id: str, db: Session = Depends(get_db)):
-    user = db.query(models.User).filter(models.User.id == user_id).first()
-    if not user:
+async def get_user_analytics(user_id: str, db: AsyncSession = Depends(get_async_db)):
+    # Counters are maintained on write (see counters.py): one primary-key lookup
+    row = (await db.execute(
+        select(models.User.view_count, models.UserStats)
+        .outerjoin(models.UserStats, models.UserStats.user_id == models.User.id)
+        .where(models.User.id == user_id)
+    )).first()
+    if not row:
         raise HTTPException(status_code=404, detail="User not found")
-        
-    interests_received = db.query(models.Interest).filter(
-        models.Interest.receiver_id == user_id,
-        models.Interest.status == "pending"
-    ).count()
 
-    interests_sent = db.query(models.Interest).filter(
-        models.Interest.sender_id == user_id
-    ).count()
-    
-    shortlisted_by = db.query(models.Shortlist).filter(
-        models.Shortlist.shortlisted_user_id == user_id
-    ).count()
-    
-    analytics = schemas.UserAnalytics(
-        total_views=user.view_count,
-        interests_received=interests_received,
-        shortlisted_by=shortlisted_by,
-        interests_sent=interests_sent
+    view_count, stats = row
+    user_analytics = schemas.UserAnalytics(
+        total_views=(view_count or 0) + view_buffer.pending_views(user_id),
+        interests_received=stats.interests_received_pending if stats else 0,
+        shortlisted_by=stats.shortlisted_by if stats else 0,
+        interests_sent=stats.interests_sent if stats else 0
     )
     
     return schemas.ApiResponse(
         status="success",
         message="Analytics fetched",
-        data=analytics.model_dump()
+        data=user_analytics.model_dump()
+    )
+
+@app.get("/profiles/{user_id}/recommendations", response_model=schemas.ApiResponse)
+def get_recommendations(user_id: str, limit: int = Query(20, ge=1, le=100), db: Session = Depends(get_db)):
+    user = db.query(models.User).filter(models.User.id == user_id).first()
+    if not user:
+        raise HTTPException(status_code=404, detail="User not found")
+
+    # Skip profiles the user already has an interest with (either direction)
+    interacted = db.query(models.Interest.sender_id, models.Interest.receiver_id).filter(
+        (models.Interest.sender_id == user_id) | (models.Interest.receiver_id == user_id)
+    ).all()
+    exclude_ids = {s if s != user_id else r for s, r in interacted}
+
+    ranked = matching.recommend(db, user, k=limit, exclude_ids=exclude_ids)
+
+    # The snapshot may be slightly stale, so re-check visibility on the live rows
+    users = db.query(models.User).filter(
+        models.User.id.in_([candidate_id for candidate_id, _ in ranked]),
+        models.User.is_active == True,
+        models.User.is_hidden == False
+    ).all()
+    users_by_id = {u.id: u for u in users}
+
+    recommendations = []
+    for candidate_id, score in ranked:
+        candidate = users_by_id.get(candidate_id)
+        if not candidate:
+            continue
+        profile = schemas.UserResponse.model_validate(candidate).model_dump()
+        profile["match_score"] = round(score * 100)
+        recommendations.append(profile)
+
+    return schemas.ApiResponse(
+        status="success",
+        message="Recommendations fetched",
+        data=recommendations
     )
 
 @app.put("/profiles/{user_id}", response_model=schemas.ApiResponse)
-async def update_profile(user_id: str, user_update: schemas.UserBase, db: Session = Depends(get_db)):
-    db_user = db.query(models.User).filter(models.User.id == user_id).first()
+async def update_profile(user_id: str, user_update: schemas.UserBase, db: AsyncSession = Depends(get_async_db)):
+    db_user = await db.get(models.User, user_id)
     if not db_user:
         raise HTTPException(status_code=404, detail="Profile not found")
     
@@ -537,26 +874,26 @@ async def update_profile(user_id: str, user_update: schemas.UserBase, db: Sessio
             )
             db.add(new_notif)
             # Push real-time update
-            await manager.send_personal_message(
+            manager.send_personal_message(
                 {"type": "new_notification", "title": "Profile Verified"},
-                user_id
+                user_id, db
             )
         elif not update_data['is_verified'] and db_user.is_verified:
             # Revoke: Delete existing "Profile Verified" notifications
-            db.query(models.Notification).filter(
+            await db.execute(delete(models.Notification).where(
                 models.Notification.user_id == user_id,
                 models.Notification.title == "Profile Verified"
-            ).delete()
+            ))
 
     # Handle premium membership changes
     if 'is_premium' in update_data:
         if update_data['is_premium'] and not db_user.is_premium:
             # User upgraded to premium
             # Check for existing premium notification to deduplicate
-            existing_premium_notif = db.query(models.Notification).filter(
+            existing_premium_notif = await db.scalar(select(models.Notification).where(
                 models.Notification.user_id == user_id,
                 models.Notification.type == "premiumMembership"
-            ).first()
+            ).limit(1))
 
             if not existing_premium_notif:
                 new_notif = models.Notification(
@@ -572,36 +909,51 @@ async def update_profile(user_id: str, user_update: schemas.UserBase, db: Sessio
             db_user.last_premium_reminder = None
             
             # Push real-time update
-            await manager.send_personal_message(
+            manager.send_personal_message(
                 {"type": "new_notification", "title": "Premium Membership Active"},
-                user_id
+                user_id, db
             )
             
             # Notify admins
-            await manager.broadcast_to_admins({
+            manager.broadcast_to_admins({
                 "type": "payment_completed",
                 "user_id": user_id,
                 "user_name": db_user.name,
                 "timestamp": datetime.now(timezone.utc).isoformat()
-            })
+            }, db)
 
+    old_media = media.user_media(db_user)
     for key, value in update_data.items():
         setattr(db_user, key, value)
-    
-    db.commit()
-    db.refresh(db_user)
+    if {'photos', 'horoscope_image_url'} & update_data.keys():
+        await media.adjust_refs(db, removed=old_media, added=media.user_media(db_user))
+
+    premium_changed = bool({'is_premium', 'premium_expiry_date', 'last_premium_reminder'} & update_data.keys())
+    if premium_changed:
+        premium.schedule(db_user)
 
     # Universal Real-Time Sync: Notify the user and all admins
-    await manager.send_personal_message(
+    manager.send_personal_message(
         {"type": "profile_updated", "user_id": user_id},
-        user_id
+        user_id, db
     )
-    await manager.broadcast_to_admins({
+    manager.broadcast_to_admins({
         "type": "profile_updated",
         "user_id": user_id,
         "user_name": db_user.name,
         "timestamp": datetime.now(timezone.utc).isoformat()
-    })
+    }, db)
+    
+    await db.commit()
+    await db.refresh(db_user)
+    analytics.invalidate()
+    profile_cache.invalidate(user_id)
+
+    if premium_changed:
+        premium_schedule_changed.set()
+    if {'is_active', 'is_hidden'} & update_data.keys():
+        # Visibility changed: rebuild the recommendation snapshot on next use
+        matching.invalidate_snapshot()
 
     return schemas.ApiResponse(
         status="success",
@@ -610,30 +962,33 @@ async def update_profile(user_id: str, user_update: schemas.UserBase, db: Sessio
     )
 
 @app.put("/profiles/{user_id}/settings", response_model=schemas.ApiResponse)
-async def update_user_settings(user_id: str, settings: schemas.UserSettingsUpdate, db: Session = Depends(get_db)):
-    db_user = db.query(models.User).filter(models.User.id == user_id).first()
+async def update_user_settings(user_id: str, settings: schemas.UserSettingsUpdate, db: AsyncSession = Depends(get_async_db)):
+    db_user = await db.get(models.User, user_id)
     if not db_user:
         raise HTTPException(status_code=404, detail="User not found")
     
     update_data = settings.model_dump(exclude_unset=True)
     for key, value in update_data.items():
         setattr(db_user, key, value)
-    
-    db.commit()
-    db.refresh(db_user)
 
     # Broadcast real-time settings update (privacy changes)
-    await manager.broadcast_to_admins({
+    manager.broadcast_to_admins({
         "type": "profile_updated",
         "user_id": user_id,
         "user_name": db_user.name,
         "timestamp": datetime.now(timezone.utc).isoformat()
-    })
+    }, db)
     # Notify the user themselves
-    await manager.send_personal_message(
+    manager.send_personal_message(
         {"type": "profile_updated", "user_id": user_id},
-        user_id
+        user_id, db
     )
+    
+    await db.commit()
+    await db.refresh(db_user)
+    profile_cache.invalidate(user_id)
+    if 'is_hidden' in update_data:
+        matching.invalidate_snapshot()
 
     return schemas.ApiResponse(
         status="success",
@@ -642,14 +997,19 @@ async def update_user_settings(user_id: str, settings: schemas.UserSettingsUpdat
     )
 
 @app.delete("/users/{user_id}", response_model=schemas.ApiResponse)
-async def delete_user(user_id: str, db: Session = Depends(get_db)):
-    db_user = db.query(models.User).filter(models.User.id == user_id).first()
+async def delete_user(user_id: str, db: AsyncSession = Depends(get_async_db)):
+    db_user = await db.get(models.User, user_id)
     if not db_user:
         raise HTTPException(status_code=404, detail="User not found")
     
     # Delete related notifications and messages (handled by CASCADE in DB)
-    db.delete(db_user)
-    db.commit()
+    await media.adjust_refs(db, removed=media.user_media(db_user) + await media.message_media(db, user_id))
+    await counters.release_user(db, user_id)
+    await db.delete(db_user)
+    await db.commit()
+    analytics.invalidate()
+    profile_cache.invalidate(user_id)
+    matching.invalidate_snapshot()
     
     return schemas.ApiResponse(
         status="success",
@@ -659,18 +1019,76 @@ async def delete_user(user_id: str, db: Session = Depends(get_db)):
 # ==================== Notification API ====================
 
 @app.get("/notifications/{user_id}", response_model=schemas.ApiResponse)
-def get_user_notifications(user_id: str, db: Session = Depends(get_db)):
-    notifications = db.query(models.Notification).filter(
-        models.Notification.user_id == user_id
-    ).order_by(models.Notification.timestamp.desc()).all()
+def get_user_notifications(
+    user_id: str,
+    before: Optional[str] = None,
+    limit: int = Query(100, ge=1, le=200),
+    db: Session = Depends(get_db)
+):
+    query = db.query(models.Notification).filter(models.Notification.user_id == user_id)
+
+    # Cursor pagination on (timestamp, id) over ix_notifications_feed, newest first
+    if before:
+        try:
+            cursor_time, cursor_id = decode_cursor(before)
+        except ValueError:
+            raise HTTPException(status_code=400, detail="Invalid cursor")
+        query = query.filter(
+            tuple_(models.Notification.timestamp, models.Notification.id) < tuple_(cursor_time, cursor_id)
+        )
+
+    notifications = query.order_by(
+        models.Notification.timestamp.desc(),
+        models.Notification.id.desc()
+    ).limit(limit).all()
     
-    notif_data = [schemas.NotificationResponse.model_validate(n).model_dump() for n in notifications]
+    notif_data = [
+        {**schemas.NotificationResponse.model_validate(n).model_dump(), "cursor": encode_cursor(n.timestamp, n.id)}
+        for n in notifications
+    ]
     return schemas.ApiResponse(
         status="success",
         message="Notifications fetched",
         data=notif_data
     )
 
+@app.get("/notifications/{user_id}/unread-count", response_model=schemas.ApiResponse)
+def get_unread_notification_count(user_id: str, db: Session = Depends(get_db)):
+    # Served from the partial index on unread rows
+    count = db.query(func.count(models.Notification.id)).filter(
+        models.Notification.user_id == user_id,
+        models.Notification.is_read == False
+    ).scalar()
+    return schemas.ApiResponse(
+        status="success",
+        message="Unread count fetched",
+        data={"unread_count": count}
+    )
+
+@app.put("/notifications/{user_id}/read-all", response_model=schemas.ApiResponse)
+def mark_all_notifications_read(user_id: str, up_to: Optional[str] = None, db: Session = Depends(get_db)):
+    # One UPDATE for everything unread, or everything up to and including the
+    # notification a feed cursor points at
+    query = db.query(models.Notification).filter(
+        models.Notification.user_id == user_id,
+        models.Notification.is_read == False
+    )
+    if up_to:
+        try:
+            cursor_time, cursor_id = decode_cursor(up_to)
+        except ValueError:
+            raise HTTPException(status_code=400, detail="Invalid cursor")
+        query = query.filter(
+            tuple_(models.Notification.timestamp, models.Notification.id) <= tuple_(cursor_time, cursor_id)
+        )
+    updated = query.update({models.Notification.is_read: True}, synchronize_session=False)
+    db.commit()
+    return schemas.ApiResponse(
+        status="success",
+        message="Notifications marked as read",
+        data={"updated": updated}
+    )
+
 @app.put("/notifications/{notification_id}/read", response_model=schemas.ApiResponse)
 def mark_notification_read(notification_id: str, db: Session = Depends(get_db)):
     notification = db.query(models.Notification).filter(models.Notification.id == notification_id).first()
@@ -687,9 +1105,9 @@ def mark_notification_read(notification_id: str, db: Session = Depends(get_db)):
 # ==================== Interest API ====================
 
 @app.post("/interests", response_model=schemas.ApiResponse)
-async def send_interest(interest: schemas.InterestCreate, db: Session = Depends(get_db)):
+async def send_interest(interest: schemas.InterestCreate, db: AsyncSession = Depends(get_async_db)):
     # Check if user exists
-    receiver = db.query(models.User).filter(models.User.id == interest.receiver_id).first()
+    receiver = await db.get(models.User, interest.receiver_id)
     if not receiver:
         raise HTTPException(status_code=404, detail="Receiver not found")
 
@@ -706,23 +1124,29 @@ async def send_interest(interest: schemas.InterestCreate, db: Session = Depends(
         related_user_id=interest.sender_id
     )
     db.add(new_notif)
-    
-    db.commit()
-    db.refresh(new_interest)
+
+    # Dashboard counters for both sides
+    changes = {interest.sender_id: {"interests_sent": 1}}
+    if new_interest.status == "pending":
+        changes.setdefault(interest.receiver_id, {})["interests_received_pending"] = 1
+    await counters.adjust_users(db, changes)
     
     # Push real-time update to receiver
-    await manager.send_personal_message(
+    manager.send_personal_message(
         {"type": "new_notification", "title": "New Interest Received"},
-        interest.receiver_id
+        interest.receiver_id, db
     )
     
     # Notify Admins: Real-time interaction log
-    await manager.broadcast_to_admins({
+    manager.broadcast_to_admins({
         "type": "interest_sent",
         "sender_id": interest.sender_id,
         "receiver_id": interest.receiver_id,
         "timestamp": datetime.now(timezone.utc).isoformat()
-    })
+    }, db)
+    
+    await db.commit()
+    await db.refresh(new_interest)
     
     return schemas.ApiResponse(
         status="success",
@@ -731,13 +1155,19 @@ async def send_interest(interest: schemas.InterestCreate, db: Session = Depends(
     )
 
 @app.put("/interests/{interest_id}", response_model=schemas.ApiResponse)
-async def update_interest_status(interest_id: str, status: str, db: Session = Depends(get_db)):
-    interest = db.query(models.Interest).filter(models.Interest.id == interest_id).first()
+async def update_interest_status(interest_id: str, status: str, db: AsyncSession = Depends(get_async_db)):
+    interest = await db.get(models.Interest, interest_id)
     if not interest:
         raise HTTPException(status_code=404, detail="Interest not found")
     
     old_status = interest.status
     interest.status = status
+
+    # Keep the receiver's pending-interest counter in step with the status
+    if old_status == "pending" and status != "pending":
+        await counters.adjust(db, interest.receiver_id, interests_received_pending=-1)
+    elif old_status != "pending" and status == "pending":
+        await counters.adjust(db, interest.receiver_id, interests_received_pending=1)
     
     if status == "accepted" and old_status != "accepted":
         # Create notification for sender
@@ -752,18 +1182,18 @@ async def update_interest_status(interest_id: str, status: str, db: Session = De
         db.add(new_notif)
         
         # Push real-time update to sender
-        await manager.send_personal_message(
+        manager.send_personal_message(
             {"type": "new_notification", "title": "Interest Accepted"},
-            interest.sender_id
+            interest.sender_id, db
         )
         
         # Notify Admins: Real-time interaction update
-        await manager.broadcast_to_admins({
+        manager.broadcast_to_admins({
             "type": "interest_accepted",
             "sender_id": interest.sender_id,
             "receiver_id": interest.receiver_id,
             "timestamp": datetime.now(timezone.utc).isoformat()
-        })
+        }, db)
 
         # IMPROVEMENT: Automatic Chat Initiation
         # Create a real database message so the conversation is persistent and visible in both screens
@@ -775,20 +1205,20 @@ async def update_interest_status(interest_id: str, status: str, db: Session = De
             is_read=True
         )
         db.add(init_msg)
+        await db.run_sync(conversations.record_message, init_msg)
+        # Load the server-generated timestamp for the payload below
+        await db.refresh(init_msg)
         
-        # Push real-time update to both (especially the sender who didn't trigger this)
-        # We wrap in try block to handle cases where they aren't online
-        try:
-            msg_data = schemas.ChatMessageResponse.model_validate(init_msg).model_dump()
-            msg_data["timestamp"] = msg_data["timestamp"].isoformat()
-            payload = {"type": "new_message", "data": msg_data}
-            await manager.send_personal_message(payload, interest.sender_id)
-            await manager.send_personal_message(payload, interest.receiver_id)
-        except Exception as e:
-            print(f"WS Broadcast error: {e}")
+        # Push real-time update to both (especially the sender who didn't trigger this);
+        # delivered once the status change commits
+        msg_data = schemas.ChatMessageResponse.model_validate(init_msg).model_dump()
+        msg_data["timestamp"] = msg_data["timestamp"].isoformat()
+        payload = {"type": "new_message", "data": msg_data}
+        manager.send_personal_message(payload, interest.sender_id, db)
+        manager.send_personal_message(payload, interest.receiver_id, db)
     
-    db.commit()
-    db.refresh(interest)
+    await db.commit()
+    await db.refresh(interest)
     return schemas.ApiResponse(
         status="success",
         message=f"Interest status updated to {status}",
@@ -811,35 +1241,33 @@ def get_user_interests(user_id: str, db: Session = Depends(get_db)):
 # ==================== Shortlist API ====================
 
 @app.post("/shortlists", response_model=schemas.ApiResponse)
-async def toggle_shortlist(shortlist: schemas.ShortlistCreate, db: Session = Depends(get_db)):
-    existing = db.query(models.Shortlist).filter(
-        models.Shortlist.user_id == shortlist.user_id,
-        models.Shortlist.shortlisted_user_id == shortlist.shortlisted_user_id
-    ).first()
+async def toggle_shortlist(shortlist: schemas.ShortlistCreate, db: AsyncSession = Depends(get_async_db)):
+    existing = await db.get(models.Shortlist, (shortlist.user_id, shortlist.shortlisted_user_id))
     
     if existing:
-        db.delete(existing)
-        db.commit()
+        await db.delete(existing)
+        await counters.adjust(db, shortlist.shortlisted_user_id, shortlisted_by=-1)
         msg = "Removed from shortlist"
     else:
         new_shortlist = models.Shortlist(**shortlist.model_dump())
         db.add(new_shortlist)
-        db.commit()
+        await counters.adjust(db, shortlist.shortlisted_user_id, shortlisted_by=1)
         msg = "Added to shortlist"
         
     # Push real-time update to the owner (in case they have multiple devices)
-    await manager.send_personal_message(
+    manager.send_personal_message(
         {"type": "shortlist_updated"},
-        shortlist.user_id
+        shortlist.user_id, db
     )
     
     # Notify Admins
-    await manager.broadcast_to_admins({
+    manager.broadcast_to_admins({
         "type": "shortlist_toggled",
         "user_id": shortlist.user_id,
         "target_id": shortlist.shortlisted_user_id,
         "action": "added" if not existing else "removed"
-    })
+    }, db)
+    await db.commit()
     
     return schemas.ApiResponse(status="success", message=msg)
 
@@ -860,20 +1288,25 @@ def get_shortlisted_profiles(user_id: str, db: Session = Depends(get_db)):
     )
 
 @app.delete("/profiles/{user_id}", response_model=schemas.ApiResponse)
-async def delete_profile(user_id: str, db: Session = Depends(get_db)):
-    db_user = db.query(models.User).filter(models.User.id == user_id).first()
+async def delete_profile(user_id: str, db: AsyncSession = Depends(get_async_db)):
+    db_user = await db.get(models.User, user_id)
     if not db_user:
         raise HTTPException(status_code=404, detail="Profile not found")
     
-    db.delete(db_user)
-    db.commit()
+    await media.adjust_refs(db, removed=media.user_media(db_user) + await media.message_media(db, user_id))
+    await counters.release_user(db, user_id)
+    await db.delete(db_user)
     
     # Notify Admins: Real-time user removal
-    await manager.broadcast_to_admins({
+    manager.broadcast_to_admins({
         "type": "profile_deleted",
         "user_id": user_id,
         "user_name": db_user.name
-    })
+    }, db)
+    await db.commit()
+    analytics.invalidate()
+    profile_cache.invalidate(user_id)
+    matching.invalidate_snapshot()
     
     return schemas.ApiResponse(
         status="success",
@@ -882,81 +1315,131 @@ async def delete_profile(user_id: str, db: Session = Depends(get_db)):
 
 # ==================== Chat API ====================
 
+@app.get("/presence", response_model=schemas.ApiResponse)
+def get_presence(user_ids: str):
+    # Comma separated ids; answered from memory, no database access
+    ids = [user_id for user_id in user_ids.split(",") if user_id]
+    return schemas.ApiResponse(
+        status="success",
+        message="Presence fetched",
+        data={user_id: presence_registry.status(user_id) for user_id in ids}
+    )
+
 @app.get("/chat/conversations/{user_id}", response_model=schemas.ApiResponse)
-def get_conversations(user_id: str, db: Session = Depends(get_db)):
-    # This query finds the latest message for each distinct conversation partner
-    # and counts unread messages from them.
-    from sqlalchemy import or_, desc
+def get_conversations(
+    user_id: str,
+    before: Optional[str] = None,
+    limit: int = Query(100, ge=1, le=200),
+    db: Session = Depends(get_db)
+):
+    # Inbox rows are maintained on write (see conversations.py), so this is a
+    # single range scan over ix_conversations_inbox joined with the partner.
+    query = db.query(
+        models.Conversation,
+        models.User.name,
+        models.User.photos[1].label("photo")
+    ).join(
+        models.User, models.User.id == models.Conversation.partner_id
+    ).filter(
+        models.Conversation.user_id == user_id,
+        models.Conversation.last_message_time != None
+    )
 
-    # 1. Get all unique conversation partners from messages
-    messages = db.query(models.ChatMessage).filter(
-        or_(
-            models.ChatMessage.sender_id == user_id,
-            models.ChatMessage.receiver_id == user_id
+    # Cursor pagination on (last_message_time, partner_id), latest first
+    if before:
+        try:
+            cursor_time, cursor_partner = decode_cursor(before)
+        except ValueError:
+            raise HTTPException(status_code=400, detail="Invalid cursor")
+        query = query.filter(
+            tuple_(models.Conversation.last_message_time, models.Conversation.partner_id)
+            < tuple_(cursor_time, cursor_partner)
         )
-    ).order_by(desc(models.ChatMessage.timestamp)).all()
-
-    partners = {}
-    for msg in messages:
-        other_id = msg.receiver_id if msg.sender_id == user_id else msg.sender_id
-        if other_id not in partners:
-            partners[other_id] = msg
-
-    # 2. Match-based logic is now simplified because we create a real message on match
-    # No more mock messages needed here.
-    # We still fetch partners from actual messages above.
-
-    conversations = []
-    for other_id, last_msg in partners.items():
-        other_user = db.query(models.User).filter(models.User.id == other_id).first()
-        if not other_user:
-            continue
-            
-        unread_count = db.query(models.ChatMessage).filter(
-            models.ChatMessage.sender_id == other_id,
-            models.ChatMessage.receiver_id == user_id,
-            models.ChatMessage.is_read == False
-        ).count()
-        
-        conversations.append({
-            "id": last_msg.id, 
-            "other_user_id": other_id,
-            "other_user_name": other_user.name,
-            "other_user_photo": other_user.photos[0] if other_user.photos else None,
-            "last_message": last_msg.text,
-            "last_message_time": last_msg.timestamp,
-            "unread_count": unread_count,
-            "is_last_message_me": last_msg.sender_id == user_id
-        })
-        
-    # Re-sort to show latest interactions first (messages or new matches)
-    conversations.sort(key=lambda x: x['last_message_time'], reverse=True)
+
+    rows = query.order_by(
+        models.Conversation.last_message_time.desc(),
+        models.Conversation.partner_id.desc()
+    ).limit(limit).all()
+
+    conversation_data = [{
+        "id": conv.last_message_id,
+        "other_user_id": conv.partner_id,
+        "other_user_name": name,
+        "other_user_photo": photo,
+        "other_user_photo_variants": images.variant_urls(photo),
+        # From the in-memory presence registry, so clients needn't poll
+        **{f"other_user_{key}": value for key, value in presence_registry.status(conv.partner_id).items()},
+        "last_message": conv.last_message,
+        "last_message_time": conv.last_message_time,
+        "unread_count": conv.unread_count,
+        "is_last_message_me": conv.last_sender_id == user_id,
+        "cursor": encode_cursor(conv.last_message_time, conv.partner_id)
+    } for conv, name, photo in rows]
 
     return schemas.ApiResponse(
         status="success",
         message="Conversations fetched",
-        data=conversations
+        data=conversation_data
     )
 
 @app.get("/chat/messages", response_model=schemas.ApiResponse)
-def get_chat_messages(user_id: str, other_user_id: str, db: Session = Depends(get_db)):
+def get_chat_messages(
+    user_id: str,
+    other_user_id: str,
+    before: Optional[str] = None,
+    after: Optional[str] = None,
+    since: Optional[datetime] = None,
+    limit: int = Query(100, ge=1, le=500),
+    db: Session = Depends(get_db)
+):
+    """
+    Page through a conversation, always returned oldest-first.
+    - no cursor: the latest `limit` messages
+    - before=<message_id>: the `limit` messages preceding that message (scrollback)
+    - after=<message_id> or since=<timestamp>: only newer messages (delta sync on reopen)
+    """
     from sqlalchemy import or_, and_
-    
-    messages = db.query(models.ChatMessage).filter(
+
+    query = db.query(models.ChatMessage).filter(
         or_(
             and_(models.ChatMessage.sender_id == user_id, models.ChatMessage.receiver_id == other_user_id),
             and_(models.ChatMessage.sender_id == other_user_id, models.ChatMessage.receiver_id == user_id)
         )
-    ).order_by(models.ChatMessage.timestamp).all()
-    
-    # Mark messages from the other user as read
-    db.query(models.ChatMessage).filter(
-        models.ChatMessage.sender_id == other_user_id,
-        models.ChatMessage.receiver_id == user_id,
-        models.ChatMessage.is_read == False
-    ).update({"is_read": True})
-    db.commit()
-    
+    )
+    position = tuple_(models.ChatMessage.timestamp, models.ChatMessage.id)
+
+    def cursor_of(message_id: str):
+        anchor = query.filter(models.ChatMessage.id == message_id).first()
+        if not anchor:
+            raise HTTPException(status_code=404, detail="Cursor message not found")
+        return tuple_(anchor.timestamp, anchor.id)
+
+    if after:
+        query = query.filter(position > cursor_of(after))
+    elif since:
+        query = query.filter(models.ChatMessage.timestamp > since)
+
+    if after or since:
+        messages = query.order_by(models.ChatMessage.timestamp, models.ChatMessage.id).limit(limit).all()
+    else:
+        if before:
+            query = query.filter(position < cursor_of(before))
+        messages = query.order_by(
+            models.ChatMessage.timestamp.desc(), models.ChatMessage.id.desc()
+        ).limit(limit).all()
+        messages.reverse()
+
+    # Mark messages from the other user as read (not needed when scrolling back
+    # through history the user has already seen)
+    if not before:
+        db.query(models.ChatMessage).filter(
+            models.ChatMessage.sender_id == other_user_id,
+            models.ChatMessage.receiver_id == user_id,
+            models.ChatMessage.is_read == False
+        ).update({"is_read": True})
+        conversations.mark_read(db, user_id, other_user_id)
+        db.commit()
+
     data = [schemas.ChatMessageResponse.model_validate(m).model_dump() for m in messages]
     return schemas.ApiResponse(status="success", message="Messages fetched", data=data)
 
@@ -967,11 +1450,12 @@ def mark_messages_as_read(user_id: str, other_user_id: str, db: Session = Depend
         models.ChatMessage.receiver_id == user_id,
         models.ChatMessage.is_read == False
     ).update({"is_read": True})
+    conversations.mark_read(db, user_id, other_user_id)
     db.commit()
     return schemas.ApiResponse(status="success", message="Messages marked as read")
 
 @app.post("/chat/send", response_model=schemas.ApiResponse)
-async def send_message(msg_data: schemas.ChatMessageCreate, sender_id: str, db: Session = Depends(get_db)):
+async def send_message(msg_data: schemas.ChatMessageCreate, sender_id: str, db: AsyncSession = Depends(get_async_db)):
     new_msg = models.ChatMessage(
         id=msg_data.id,
         sender_id=sender_id,
@@ -981,11 +1465,12 @@ async def send_message(msg_data: schemas.ChatMessageCreate, sender_id: str, db:
         attachment_type=msg_data.attachment_type
     )
     db.add(new_msg)
-    db.commit()
-    db.refresh(new_msg)
+    await db.run_sync(conversations.record_message, new_msg)
+    await media.adjust_refs(db, added=[new_msg.attachment_url])
+    # Load the server-generated timestamp for the payload below
+    await db.refresh(new_msg)
     
-    
-    # Send via WebSocket
+    # Send via WebSocket, through the outbox in the same transaction
     payload = {
         "type": "new_message",
         "data": schemas.ChatMessageResponse.model_validate(new_msg).model_dump()
@@ -993,29 +1478,25 @@ async def send_message(msg_data: schemas.ChatMessageCreate, sender_id: str, db:
     # Payload format needs to handle datetime serialization
     payload["data"]["timestamp"] = payload["data"]["timestamp"].isoformat()
     
-    await manager.send_personal_message(payload, msg_data.receiver_id)
+    manager.send_personal_message(payload, msg_data.receiver_id, db)
+    await db.commit()
     
     return schemas.ApiResponse(status="success", message="Message sent", data=schemas.ChatMessageResponse.model_validate(new_msg).model_dump())
 
 @app.post("/chat/upload", response_model=schemas.ApiResponse)
-async def upload_chat_attachment(file: UploadFile = File(...)):
+async def upload_chat_attachment(file: UploadFile = File(...), db: AsyncSession = Depends(get_async_db)):
     try:
-        file_id = str(uuid.uuid4())
-        extension = os.path.splitext(file.filename)[1]
-        file_name = f"{file_id}{extension}"
-        file_path = f"backend/uploads/{file_name}"
-        
-        with open(file_path, "wb") as buffer:
-            shutil.copyfileobj(file.file, buffer)
+        staged = await storage.stage_upload(file)
+        url = await media.store(db, staged)
             
         # Return relative URL, client should prepend base URL
-        url = f"/uploads/{file_name}" 
-        
         return schemas.ApiResponse(
             status="success", 
             message="File uploaded successfully", 
-            data={"url": url, "type": "image"} # Assuming image for now
+            data={"url": url, "type": "image", "size": staged.size, "sha256": staged.sha256} # Assuming image for now
         )
+    except storage.UploadTooLarge:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
@@ -0,0 +1,264 @@
+"""
+Compatibility scoring engine for the "recommended for you" feed.
+
+Candidates are scored in batch against a compact columnar snapshot of the
+visible profiles in the users table. Categorical fields are dictionary-encoded
+into integer arrays so every comparison is a vectorized NumPy operation, and
+the top-K results are selected with a heap instead of sorting every candidate.
+"""
+import heapq
+import os
+import re
+import threading
+import time
+from typing import Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+from sqlalchemy.orm import Session
+
+from . import models
+
+# Relative importance of each signal (sums to 1.0)
+WEIGHTS = {
+    "age": 0.20,
+    "height": 0.10,
+    "caste": 0.15,
+    "mother_tongue": 0.10,
+    "languages": 0.10,
+    "location": 0.10,
+    "education": 0.05,
+    "preferences": 0.20,
+}
+
+# Seconds a snapshot is reused before it is rebuilt from the database
+SNAPSHOT_TTL = int(os.getenv("MATCH_SNAPSHOT_TTL", "300"))
+
+# Categorical columns that are dictionary-encoded in the snapshot
+CATEGORICAL_FIELDS = (
+    "gender", "marital_status", "caste", "sub_caste", "mother_tongue",
+    "location", "hometown", "education", "occupation",
+)
+
+# Fields whose values are looked for in the free-text partner preferences
+PREFERENCE_FIELDS = (
+    "caste", "sub_caste", "mother_tongue", "location", "hometown",
+    "education", "occupation", "marital_status",
+)
+
+MISSING = -1
+UNKNOWN = -2
+
+_AGE_RANGE = re.compile(r"\b(1[89]|[2-7]\d)\s*(?:-|to|–)\s*(1[89]|[2-7]\d)\b")
+
+
+def _normalize(value: Optional[str]) -> Optional[str]:
+    if value is None:
+        return None
+    value = value.strip().lower()
+    return value or None
+
+
+def parse_age_range(preferences: Optional[str]) -> Tuple[float, float]:
+    """Extract an age range such as "25-30" or "25 to 30" from preference text."""
+    if preferences:
+        match = _AGE_RANGE.search(preferences)
+        if match:
+            low, high = sorted((int(match.group(1)), int(match.group(2))))
+            return float(low), float(high)
+    return np.nan, np.nan
+
+
+class ProfileSnapshot:
+    """Columnar, read-only copy of the candidate profiles."""
+
+    def __init__(self, rows: Sequence):
+        self.created_at = time.monotonic()
+        self.ids: List[str] = [row.id for row in rows]
+        self.positions: Dict[str, int] = {user_id: i for i, user_id in enumerate(self.ids)}
+
+        self.age = np.array([row.age for row in rows], dtype=np.float32)
+        self.height = np.array([row.height for row in rows], dtype=np.float32)
+
+        self.vocab: Dict[str, Dict[str, int]] = {}
+        self.codes: Dict[str, np.ndarray] = {}
+        for field in CATEGORICAL_FIELDS:
+            vocab: Dict[str, int] = {}
+            codes = np.empty(len(rows), dtype=np.int32)
+            for i, row in enumerate(rows):
+                value = _normalize(getattr(row, field))
+                codes[i] = MISSING if value is None else vocab.setdefault(value, len(vocab))
+            self.vocab[field] = vocab
+            self.codes[field] = codes
+
+        # Languages as a multi-hot matrix so overlap is a single mat-vec product
+        self.language_vocab: Dict[str, int] = {}
+        language_rows = []
+        for row in rows:
+            language_rows.append({
+                self.language_vocab.setdefault(lang, len(self.language_vocab))
+                for lang in filter(None, map(_normalize, row.languages or []))
+            })
+        self.languages = np.zeros((len(rows), max(len(self.language_vocab), 1)), dtype=np.uint8)
+        for i, indices in enumerate(language_rows):
+            self.languages[i, list(indices)] = 1
+
+        # Candidates' own preferred age ranges, for reciprocal scoring
+        ranges = [parse_age_range(row.partner_preferences) for row in rows]
+        self.pref_min_age = np.array([r[0] for r in ranges], dtype=np.float32)
+        self.pref_max_age = np.array([r[1] for r in ranges], dtype=np.float32)
+
+    def __len__(self):
+        return len(self.ids)
+
+    @property
+    def is_stale(self) -> bool:
+        return time.monotonic() - self.created_at > SNAPSHOT_TTL
+
+    @classmethod
+    def load(cls, db: Session) -> "ProfileSnapshot":
+        columns = [models.User.id, models.User.age, models.User.height,
+                   models.User.languages, models.User.partner_preferences]
+        columns += [getattr(models.User, field) for field in CATEGORICAL_FIELDS]
+        rows = db.query(*columns).filter(
+            models.User.is_active == True,
+            models.User.is_hidden == False
+        ).all()
+        return cls(rows)
+
+    def encode(self, field: str, value: Optional[str]) -> int:
+        value = _normalize(value)
+        if value is None:
+            return MISSING
+        return self.vocab[field].get(value, UNKNOWN)
+
+    def preference_mask(self, field: str, preferences: str) -> np.ndarray:
+        """Boolean lookup over a field's vocabulary: is this value mentioned in the text?"""
+        vocab = self.vocab[field]
+        mask = np.zeros(len(vocab) + 1, dtype=bool)  # trailing slot absorbs MISSING
+        for value, code in vocab.items():
+            if len(value) > 2 and re.search(r"\b" + re.escape(value) + r"\b", preferences):
+                mask[code] = True
+        return mask
+
+
+_snapshot: Optional[ProfileSnapshot] = None
+_snapshot_lock = threading.Lock()
+
+
+def get_snapshot(db: Session) -> ProfileSnapshot:
+    global _snapshot
+    with _snapshot_lock:
+        if _snapshot is None or _snapshot.is_stale:
+            _snapshot = ProfileSnapshot.load(db)
+        return _snapshot
+
+
+def invalidate_snapshot():
+    """Drop this worker's snapshot; other workers catch up within SNAPSHOT_TTL."""
+    global _snapshot
+    with _snapshot_lock:
+        _snapshot = None
+
+
+def _equal(snapshot: ProfileSnapshot, field: str, value: Optional[str]) -> np.ndarray:
+    code = snapshot.encode(field, value)
+    if code < 0:
+        return np.zeros(len(snapshot), dtype=np.float32)
+    return (snapshot.codes[field] == code).astype(np.float32)
+
+
+def score_candidates(snapshot: ProfileSnapshot, viewer) -> np.ndarray:
+    """
+    Score every snapshot candidate against the viewer in one vectorized pass.
+    Returns values in [0, 1]; ineligible candidates get -inf.
+    """
+    n = len(snapshot)
+    if n == 0:
+        return np.empty(0, dtype=np.float32)
+
+    # Age: inside the viewer's stated range scores 1, otherwise decays with distance
+    pref_min, pref_max = parse_age_range(viewer.partner_preferences)
+    if np.isnan(pref_min):
+        age_gap = np.abs(snapshot.age - viewer.age)
+    else:
+        age_gap = np.maximum(pref_min - snapshot.age, 0) + np.maximum(snapshot.age - pref_max, 0)
+    age_score = np.exp(-age_gap / 4.0)
+
+    # Height is stored in feet
+    height_score = np.exp(-np.abs(snapshot.height - viewer.height) / 0.5)
+
+    caste_score = 0.7 * _equal(snapshot, "caste", viewer.caste) \
+        + 0.3 * _equal(snapshot, "sub_caste", viewer.sub_caste)
+    mother_tongue_score = _equal(snapshot, "mother_tongue", viewer.mother_tongue)
+
+    viewer_languages = np.zeros(snapshot.languages.shape[1], dtype=np.float32)
+    for lang in filter(None, map(_normalize, viewer.languages or [])):
+        index = snapshot.language_vocab.get(lang)
+        if index is not None:
+            viewer_languages[index] = 1
+    if viewer_languages.any():
+        language_score = (snapshot.languages @ viewer_languages) / viewer_languages.sum()
+    else:
+        language_score = np.zeros(n, dtype=np.float32)
+
+    # Same city is best; a shared hometown (either way round) still counts
+    location_score = np.maximum.reduce([
+        _equal(snapshot, "location", viewer.location),
+        0.6 * _equal(snapshot, "hometown", viewer.hometown),
+        0.5 * _equal(snapshot, "hometown", viewer.location),
+        0.5 * _equal(snapshot, "location", viewer.hometown),
+    ])
+    education_score = _equal(snapshot, "education", viewer.education)
+
+    # Free-text preferences: how many of the candidate's attributes the viewer
+    # mentions, plus whether the viewer fits the candidate's own age range.
+    preferences = _normalize(viewer.partner_preferences)
+    if preferences:
+        hits = np.zeros(n, dtype=np.float32)
+        for field in PREFERENCE_FIELDS:
+            hits += snapshot.preference_mask(field, preferences)[snapshot.codes[field]]
+        keyword_score = np.minimum(hits / 2.0, 1.0)
+    else:
+        keyword_score = np.full(n, 0.5, dtype=np.float32)
+    reciprocal_age = np.where(
+        np.isnan(snapshot.pref_min_age),
+        0.5,
+        ((snapshot.pref_min_age <= viewer.age) & (viewer.age <= snapshot.pref_max_age)).astype(np.float32)
+    )
+    preference_score = 0.7 * keyword_score + 0.3 * reciprocal_age
+
+    scores = (
+        WEIGHTS["age"] * age_score
+        + WEIGHTS["height"] * height_score
+        + WEIGHTS["caste"] * caste_score
+        + WEIGHTS["mother_tongue"] * mother_tongue_score
+        + WEIGHTS["languages"] * language_score
+        + WEIGHTS["location"] * location_score
+        + WEIGHTS["education"] * education_score
+        + WEIGHTS["preferences"] * preference_score
+    ).astype(np.float32)
+
+    # Only opposite-gender candidates are eligible
+    viewer_gender = _normalize(viewer.gender)
+    if viewer_gender in ("male", "female"):
+        wanted = "female" if viewer_gender == "male" else "male"
+        scores[snapshot.codes["gender"] != snapshot.encode("gender", wanted)] = -np.inf
+
+    return scores
+
+
+def top_k(snapshot: ProfileSnapshot, scores: np.ndarray, k: int, exclude_ids=()) -> List[Tuple[str, float]]:
+    """Best k (user_id, score) pairs, selected with a bounded heap."""
+    for user_id in exclude_ids:
+        position = snapshot.positions.get(user_id)
+        if position is not None:
+            scores[position] = -np.inf
+    eligible = np.flatnonzero(np.isfinite(scores))
+    best = heapq.nlargest(k, eligible.tolist(), key=scores.__getitem__)
+    return [(snapshot.ids[i], float(scores[i])) for i in best]
+
+
+def recommend(db: Session, viewer, k: int = 20, exclude_ids=()) -> List[Tuple[str, float]]:
+    snapshot = get_snapshot(db)
+    scores = score_candidates(snapshot, viewer)
+    return top_k(snapshot, scores, k, exclude_ids={viewer.id, *exclude_ids})
@@ -0,0 +1,180 @@
+"""
+Content-addressed, deduplicated media store.
+
+Uploads are stored once per content hash under hash-sharded directories
+(uploads/blobs/ab/cd/<sha256>.<ext>), so re-uploading a photo or forwarding
+an attachment reuses the existing file. Each blob's `ref_count` tracks how
+many of User.photos, User.horoscope_image_url and ChatMessage.attachment_url
+point at it; handlers adjust it in the same transaction as the change, and
+gc() removes blobs nobody references. Recounting references from the source
+tables (reconcile) scans users and chat_messages, so it is left to
+scripts/gc_media.py unless MEDIA_GC_RECONCILE_INTERVAL is set.
+Files uploaded before the store existed keep their flat /uploads/<uuid> URLs
+and are left alone.
+"""
+import asyncio
+import os
+from collections import Counter
+from datetime import datetime, timedelta, timezone
+from typing import Iterable, List, Optional
+
+from sqlalchemy import func, or_, select, text, update
+from sqlalchemy.dialects.postgresql import insert
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from . import images, models, storage
+from .database import async_engine
+
+BLOB_DIR = "blobs"
+URL_PREFIX = f"/uploads/{BLOB_DIR}/"
+# Unreferenced blobs are kept this long after their last upload/reference,
+# so a file uploaded just before the profile or message using it is saved survives
+GC_GRACE = timedelta(seconds=int(os.getenv("MEDIA_GC_GRACE", str(24 * 3600))))
+GC_BATCH_SIZE = int(os.getenv("MEDIA_GC_BATCH_SIZE", "500"))
+GC_INTERVAL = int(os.getenv("MEDIA_GC_INTERVAL", "3600"))
+# Seconds between reconciles in the background job; 0 leaves them to the CLI
+GC_RECONCILE_INTERVAL = int(os.getenv("MEDIA_GC_RECONCILE_INTERVAL", "0"))
+# Arbitrary constant identifying the GC's advisory lock
+GC_LOCK_KEY = 7304003
+
+# Recount references from the source columns, fixing any drift (manual edits
+# or other writes that bypass adjust_refs)
+RECONCILE_SQL = text(f"""
+WITH refs AS (
+    SELECT url, count(*) AS count FROM (
+        SELECT unnest(photos) AS url FROM users
+        UNION ALL SELECT horoscope_image_url FROM users
+        UNION ALL SELECT attachment_url FROM chat_messages
+    ) r
+    WHERE url LIKE '{URL_PREFIX}%'
+    GROUP BY url
+)
+UPDATE media_blobs b SET ref_count = COALESCE(refs.count, 0)
+FROM media_blobs b2
+LEFT JOIN refs ON refs.url = '/uploads/' || b2.path
+WHERE b2.sha256 = b.sha256 AND b.ref_count <> COALESCE(refs.count, 0)
+""")
+
+SWEEP_SQL = text("""
+DELETE FROM media_blobs
+WHERE sha256 IN (
+    SELECT sha256 FROM media_blobs
+    WHERE ref_count = 0 AND last_seen_at < :cutoff
+    ORDER BY last_seen_at
+    LIMIT :batch_size
+    FOR UPDATE SKIP LOCKED
+)
+RETURNING path
+""")
+
+
+def blob_path(sha256: str, extension: str) -> str:
+    return f"{BLOB_DIR}/{sha256[:2]}/{sha256[2:4]}/{sha256}{extension}"
+
+
+def blob_hash(url: Optional[str]) -> Optional[str]:
+    """The content hash behind a store URL, or None for anything else."""
+    if not url or not url.startswith(URL_PREFIX):
+        return None
+    return os.path.splitext(url.rsplit("/", 1)[-1])[0]
+
+
+def user_media(user: models.User) -> List[str]:
+    return list(user.photos or []) + ([user.horoscope_image_url] if user.horoscope_image_url else [])
+
+
+async def store(db: AsyncSession, staged: storage.StagedFile) -> str:
+    """Commit a staged upload into the store and return its URL."""
+    table = models.MediaBlob.__table__
+    try:
+        # Upsert first: if GC is deleting this blob right now, the row lock makes
+        # us wait until its files are gone before the file is written back
+        path = await db.scalar(
+            insert(table).values(
+                sha256=staged.sha256,
+                path=blob_path(staged.sha256, staged.extension),
+                size=staged.size,
+            ).on_conflict_do_update(
+                index_elements=[table.c.sha256],
+                set_={"last_seen_at": func.now()}
+            ).returning(table.c.path)
+        )
+        await db.commit()
+        # Same content under the same name, so replacing an existing copy is harmless
+        await asyncio.to_thread(storage.move_into_place, staged.tmp_path, path)
+    except BaseException:
+        await asyncio.to_thread(storage.remove_quietly, staged.tmp_path)
+        raise
+    return f"/uploads/{path}"
+
+
+async def adjust_refs(db: AsyncSession, removed: Iterable[Optional[str]] = (), added: Iterable[Optional[str]] = ()):
+    """Apply reference changes for URLs dropped from / added to the tracked columns."""
+    deltas = Counter()
+    for url in added:
+        sha256 = blob_hash(url)
+        if sha256:
+            deltas[sha256] += 1
+    for url in removed:
+        sha256 = blob_hash(url)
+        if sha256:
+            deltas[sha256] -= 1
+    blob = models.MediaBlob
+    for sha256, delta in deltas.items():
+        if not delta:
+            continue
+        values = {"ref_count": func.greatest(blob.ref_count + delta, 0)}
+        if delta > 0:
+            values["last_seen_at"] = func.now()
+        await db.execute(update(blob).where(blob.sha256 == sha256).values(**values))
+
+
+async def message_media(db: AsyncSession, user_id: str) -> List[str]:
+    """Attachments in a user's conversations, which go when the user is deleted."""
+    return list(await db.scalars(
+        select(models.ChatMessage.attachment_url).where(
+            or_(models.ChatMessage.sender_id == user_id, models.ChatMessage.receiver_id == user_id),
+            models.ChatMessage.attachment_url.like(f"{URL_PREFIX}%")
+        )
+    ))
+
+
+def _remove_files(paths: List[str]):
+    for path in paths:
+        storage.remove_quietly(os.path.join(storage.UPLOAD_DIR, path))
+        images.remove_variants(path)
+
+
+async def gc(db: AsyncSession, reconcile: bool = False) -> dict:
+    """Optionally reconcile reference counts, then delete unreferenced blobs in batches."""
+    reconciled = 0
+    if reconcile:
+        reconciled = (await db.execute(RECONCILE_SQL)).rowcount
+        await db.commit()
+
+    cutoff = datetime.now(timezone.utc) - GC_GRACE
+    removed = 0
+    while True:
+        paths = list((await db.execute(SWEEP_SQL, {"cutoff": cutoff, "batch_size": GC_BATCH_SIZE})).scalars())
+        # Files go before the commit, while the deleted rows are still locked
+        await asyncio.to_thread(_remove_files, paths)
+        await db.commit()
+        removed += len(paths)
+        if len(paths) < GC_BATCH_SIZE:
+            break
+    return {"reconciled": reconciled, "removed": removed}
+
+
+async def gc_exclusive(reconcile: bool = False) -> Optional[dict]:
+    """Run gc() unless another worker already is; None when skipped."""
+    async with async_engine.connect() as conn:
+        # Session-level lock, as gc() commits once per batch
+        if not await conn.scalar(select(func.pg_try_advisory_lock(GC_LOCK_KEY))):
+            return None
+        await conn.commit()
+        try:
+            async with AsyncSession(bind=conn, autoflush=False, expire_on_commit=False) as db:
+                return await gc(db, reconcile)
+        finally:
+            await conn.execute(select(func.pg_advisory_unlock(GC_LOCK_KEY)))
+            await conn.commit()
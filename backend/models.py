@@ -1,4 +1,5 @@
-from sqlalchemy import Column, String, Integer, Double, Boolean, DateTime, ForeignKey, Text, ARRAY, Date
+from sqlalchemy import Column, String, Integer, BigInteger, Double, Boolean, DateTime, ForeignKey, Text, ARRAY, Date, Index
+from sqlalchemy.dialects.postgresql import JSONB
 from sqlalchemy.sql import func
 from .database import Base
 
@@ -43,6 +44,18 @@ class User(Base):
     created_at = Column(DateTime(timezone=True), server_default=func.now())
     premium_expiry_date = Column(DateTime(timezone=True), nullable=True)
     last_premium_reminder = Column(String, nullable=True)
+    # Next time a premium reminder or the expiry is due (see premium.py)
+    premium_next_check_at = Column(DateTime(timezone=True), nullable=True, index=True)
+
+    __table_args__ = (
+        # Profile search: visibility flags + gender lead every discovery query,
+        # (created_at, id) is the keyset used for cursor pagination.
+        Index("ix_users_search_keyset", "is_active", "is_hidden", "gender", "created_at", "id"),
+        Index("ix_users_gender_age", "gender", "age"),
+        Index("ix_users_gender_height", "gender", "height"),
+        Index("ix_users_community", "mother_tongue", "caste", "sub_caste"),
+        Index("ix_users_location", "location"),
+    )
 
 class Interest(Base):
     __tablename__ = "interests"
@@ -60,6 +73,15 @@ class Shortlist(Base):
     shortlisted_user_id = Column(String, ForeignKey("users.id", ondelete="CASCADE"), primary_key=True)
     created_at = Column(DateTime(timezone=True), server_default=func.now())
 
+class UserStats(Base):
+    """Per-user dashboard counters, maintained by the handlers that change them."""
+    __tablename__ = "user_stats"
+
+    user_id = Column(String, ForeignKey("users.id", ondelete="CASCADE"), primary_key=True)
+    interests_received_pending = Column(Integer, nullable=False, default=0, server_default="0")
+    interests_sent = Column(Integer, nullable=False, default=0, server_default="0")
+    shortlisted_by = Column(Integer, nullable=False, default=0, server_default="0")
+
 class Admin(Base):
     __tablename__ = "admins"
 
@@ -80,6 +102,31 @@ class Notification(Base):
     is_read = Column(Boolean, default=False)
     related_user_id = Column(String, ForeignKey("users.id", ondelete="SET NULL"), nullable=True)
     timestamp = Column(DateTime(timezone=True), server_default=func.now())
+    # Coalesced notifications: repeated events with the same group_key are merged
+    # into the user's unread row for that group (see notifications.py)
+    group_key = Column(String, nullable=True)
+    actor_count = Column(Integer, nullable=False, default=1, server_default="1")
+    actor_ids = Column(ARRAY(String))  # most recent first, capped
+
+    __table_args__ = (
+        # Feed pages, newest first (scanned backwards)
+        Index("ix_notifications_feed", "user_id", "timestamp", "id"),
+        # Unread badge: only the typically small set of unread rows is indexed
+        Index("ix_notifications_unread", "user_id", postgresql_where=(is_read == False)),
+        # At most one open (unread) aggregate per group; the upsert target
+        Index("ix_notifications_open_group", "user_id", "group_key", unique=True,
+              postgresql_where=(is_read == False) & (group_key != None)),
+        # Retention job: old read rows
+        Index("ix_notifications_read_timestamp", "timestamp", postgresql_where=(is_read == True)),
+    )
+
+class NotificationActor(Base):
+    """Distinct actors merged into an aggregated notification, so none is counted twice."""
+    __tablename__ = "notification_actors"
+
+    notification_id = Column(String, ForeignKey("notifications.id", ondelete="CASCADE"), primary_key=True)
+    actor_id = Column(String, primary_key=True)
+
 class ChatMessage(Base):
     __tablename__ = "chat_messages"
 
@@ -91,3 +138,74 @@ class ChatMessage(Base):
     timestamp = Column(DateTime(timezone=True), server_default=func.now())
     attachment_url = Column(String, nullable=True)
     attachment_type = Column(String, nullable=True)
+
+    __table_args__ = (
+        # Covering indexes for conversation lookups in either direction
+        Index("ix_chat_messages_conversation", "sender_id", "receiver_id", "timestamp"),
+        Index("ix_chat_messages_conversation_rev", "receiver_id", "sender_id", "timestamp"),
+    )
+
+class Conversation(Base):
+    """Per-user inbox row, maintained on write alongside chat_messages."""
+    __tablename__ = "conversations"
+
+    user_id = Column(String, ForeignKey("users.id", ondelete="CASCADE"), primary_key=True)
+    partner_id = Column(String, ForeignKey("users.id", ondelete="CASCADE"), primary_key=True)
+    last_message_id = Column(String, ForeignKey("chat_messages.id", ondelete="SET NULL"), nullable=True)
+    last_message = Column(Text)
+    last_message_time = Column(DateTime(timezone=True))
+    last_sender_id = Column(String)
+    unread_count = Column(Integer, nullable=False, default=0, server_default="0")
+
+    __table_args__ = (
+        # Inbox: a user's conversations, latest first
+        Index("ix_conversations_inbox", "user_id", "last_message_time", "partner_id"),
+    )
+
+class MediaBlob(Base):
+    """One stored upload, keyed by content hash and shared by every reference to it."""
+    __tablename__ = "media_blobs"
+
+    sha256 = Column(String, primary_key=True)
+    path = Column(String, nullable=False)  # relative to the uploads directory
+    size = Column(Integer, nullable=False)
+    ref_count = Column(Integer, nullable=False, default=0, server_default="0")
+    created_at = Column(DateTime(timezone=True), server_default=func.now())
+    # Last upload of, or new reference to, this blob; GC waits a grace period after it
+    last_seen_at = Column(DateTime(timezone=True), server_default=func.now())
+
+    __table_args__ = (
+        Index("ix_media_blobs_unreferenced", "last_seen_at", postgresql_where=(ref_count == 0)),
+    )
+
+class OutboxEvent(Base):
+    """Real-time event committed with the change it describes, awaiting dispatch."""
+    __tablename__ = "outbox_events"
+
+    id = Column(BigInteger, primary_key=True, autoincrement=True)
+    envelope = Column(JSONB, nullable=False)  # backplane envelope, see outbox.py
+    created_at = Column(DateTime(timezone=True), server_default=func.now())
+
+class UserEvent(Base):
+    """Recent real-time events per user, replayed to clients that reconnect."""
+    __tablename__ = "user_events"
+
+    user_id = Column(String, ForeignKey("users.id", ondelete="CASCADE"), primary_key=True)
+    seq = Column(BigInteger, primary_key=True)  # per-user, see UserEventSeq
+    message = Column(JSONB, nullable=False)
+    created_at = Column(DateTime(timezone=True), server_default=func.now())
+
+class UserEventSeq(Base):
+    """Last event sequence number handed out per user; its row lock orders dispatch."""
+    __tablename__ = "user_event_seqs"
+
+    user_id = Column(String, ForeignKey("users.id", ondelete="CASCADE"), primary_key=True)
+    last_seq = Column(BigInteger, nullable=False, default=0, server_default="0")
+
+class BackplanePayload(Base):
+    """Backplane envelope too large for NOTIFY; the notification carries its id."""
+    __tablename__ = "backplane_payloads"
+
+    id = Column(BigInteger, primary_key=True, autoincrement=True)
+    envelope = Column(JSONB, nullable=False)
+    created_at = Column(DateTime(timezone=True), server_default=func.now(), index=True)
@@ -0,0 +1,154 @@
+"""
+Notification coalescing and retention.
+
+Repeated events of one kind (profile views, premium reminders) are merged
+into a single unread notification per user and `group_key` instead of adding
+a row each time: the row keeps a counter and the most recent actors, and its
+text is rewritten ("12 people viewed your profile"). Once the user reads it,
+the next event starts a new aggregate. Profile viewers are also recorded in
+`notification_actors`, so a repeat viewer is not counted twice.
+
+compact() deletes read notifications older than the retention period in
+bounded batches, so the table no longer grows without limit.
+"""
+import os
+from datetime import datetime, timedelta, timezone
+from typing import List, Tuple
+
+from sqlalchemy import func, text
+from sqlalchemy.dialects.postgresql import insert
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from . import models
+
+GROUP_PROFILE_VIEWS = "profileView"
+GROUP_PREMIUM = "premium"
+# Actors listed on an aggregated notification in API responses
+MAX_ACTORS = int(os.getenv("NOTIFICATION_MAX_ACTORS", "5"))
+
+RETENTION = timedelta(days=int(os.getenv("NOTIFICATION_RETENTION_DAYS", "90")))
+COMPACTION_BATCH_SIZE = int(os.getenv("NOTIFICATION_COMPACTION_BATCH_SIZE", "1000"))
+COMPACTION_INTERVAL = int(os.getenv("NOTIFICATION_COMPACTION_INTERVAL", "3600"))
+
+# ON CONFLICT target matching ix_notifications_open_group
+OPEN_GROUP_WHERE = "is_read = false AND group_key IS NOT NULL"
+
+# Buffered (profile, viewer) pairs, latest recording order per pair, for
+# profiles and viewers that still exist
+VIEW_PAIRS_CTE = """
+pairs AS (
+    SELECT d.user_id, d.viewer_id, max(d.ord) AS ord
+    FROM unnest(CAST(:user_ids AS text[]), CAST(:viewer_ids AS text[]), CAST(:ords AS integer[]))
+        AS d(user_id, viewer_id, ord)
+    JOIN users owner ON owner.id = d.user_id
+    JOIN users viewer ON viewer.id = d.viewer_id
+    GROUP BY d.user_id, d.viewer_id
+)
+"""
+
+# Make sure every viewed profile has an open "Profile Viewed" aggregate; a new
+# one starts empty and is filled in by MERGE_VIEWERS_SQL in the same transaction
+OPEN_VIEWS_SQL = text(f"""
+WITH {VIEW_PAIRS_CTE}
+INSERT INTO notifications
+    (id, user_id, title, message, type, is_read, timestamp, group_key, actor_count, actor_ids)
+SELECT gen_random_uuid()::text, user_id, 'Profile Viewed', '', 'profileView', false, now(),
+       '{GROUP_PROFILE_VIEWS}', 0, '{{}}'
+FROM (SELECT DISTINCT user_id FROM pairs) owners
+ORDER BY user_id
+ON CONFLICT (user_id, group_key) WHERE {OPEN_GROUP_WHERE} DO NOTHING
+""")
+
+# Record the viewers in notification_actors, whose key lets each distinct viewer
+# count once per aggregate, and update the aggregates that gained any. Only the
+# new viewers and the MAX_ACTORS ids kept on the row are touched.
+MERGE_VIEWERS_SQL = text(f"""
+WITH {VIEW_PAIRS_CTE},
+added AS (
+    INSERT INTO notification_actors (notification_id, actor_id)
+    SELECT n.id, pairs.viewer_id
+    FROM pairs
+    JOIN notifications n ON n.user_id = pairs.user_id
+        AND n.group_key = '{GROUP_PROFILE_VIEWS}' AND n.is_read = false
+    ORDER BY n.id, pairs.viewer_id
+    ON CONFLICT DO NOTHING
+    RETURNING notification_id, actor_id
+), agg AS (
+    SELECT added.notification_id,
+           count(*) AS new_count,
+           array_agg(added.actor_id ORDER BY pairs.ord DESC) AS new_ids,
+           (array_agg(viewer.name ORDER BY pairs.ord DESC))[1] AS last_name
+    FROM added
+    JOIN notifications n ON n.id = added.notification_id
+    JOIN pairs ON pairs.user_id = n.user_id AND pairs.viewer_id = added.actor_id
+    JOIN users viewer ON viewer.id = added.actor_id
+    GROUP BY added.notification_id
+)
+UPDATE notifications n SET
+    actor_count = n.actor_count + agg.new_count,
+    actor_ids = (agg.new_ids[1:{MAX_ACTORS}] || ARRAY(
+        SELECT a FROM unnest(n.actor_ids) a WHERE a <> ALL(agg.new_ids[1:{MAX_ACTORS}])
+    ))[1:{MAX_ACTORS}],
+    related_user_id = agg.new_ids[1],
+    message = CASE WHEN n.actor_count + agg.new_count = 1 THEN agg.last_name || ' viewed your profile!'
+                   ELSE (n.actor_count + agg.new_count) || ' people viewed your profile' END,
+    timestamp = now()
+FROM agg
+WHERE n.id = agg.notification_id
+RETURNING n.user_id
+""")
+
+
+async def coalesce_views(db: AsyncSession, pairs: List[Tuple[str, str]]) -> List[str]:
+    """
+    Merge (profile, viewer) pairs, in recording order, into the owners' open
+    "Profile Viewed" notifications. Returns the owners whose notification changed.
+    """
+    params = {
+        "user_ids": [user_id for user_id, _ in pairs],
+        "viewer_ids": [viewer_id for _, viewer_id in pairs],
+        # Recording order, so the latest viewer is listed first
+        "ords": list(range(len(pairs))),
+    }
+    await db.execute(OPEN_VIEWS_SQL, params)
+    return list((await db.execute(MERGE_VIEWERS_SQL, params)).scalars())
+
+
+def upsert_grouped():
+    """
+    INSERT for notifications carrying a group_key: a new event replaces the
+    text of the user's open notification in that group and bumps its counter.
+    """
+    table = models.Notification.__table__
+    stmt = insert(table)
+    return stmt.on_conflict_do_update(
+        index_elements=[table.c.user_id, table.c.group_key],
+        index_where=text(OPEN_GROUP_WHERE),
+        set_={
+            "title": stmt.excluded.title,
+            "message": stmt.excluded.message,
+            "type": stmt.excluded.type,
+            "actor_count": table.c.actor_count + 1,
+            "timestamp": func.now(),
+        }
+    )
+
+
+async def compact(db: AsyncSession) -> int:
+    """Delete read notifications past the retention period, one batch per transaction."""
+    cutoff = datetime.now(timezone.utc) - RETENTION
+    removed = 0
+    while True:
+        result = await db.execute(text("""
+            DELETE FROM notifications
+            WHERE id IN (
+                SELECT id FROM notifications
+                WHERE is_read = true AND timestamp < :cutoff
+                LIMIT :batch_size
+                FOR UPDATE SKIP LOCKED
+            )
+        """), {"cutoff": cutoff, "batch_size": COMPACTION_BATCH_SIZE})
+        await db.commit()
+        removed += result.rowcount
+        if result.rowcount < COMPACTION_BATCH_SIZE:
+            return removed
@@ -0,0 +1,92 @@
+"""
+Transactional outbox for real-time events.
+
+Handlers add WebSocket events to their own session, so an event is committed
+together with the change it describes and disappears with it on rollback.
+A dispatcher task drains committed events in batches and publishes them to
+the backplane. An event is only removed in the same transaction that
+published it, so delivery is at-least-once.
+
+Envelopes are {"target": "user", "user_id": ..., "message": {...}} or
+{"target": "admins", "message": {...}}, as consumed by ConnectionManager.deliver.
+"""
+import asyncio
+import os
+from typing import Awaitable, Callable, Optional
+
+from fastapi.encoders import jsonable_encoder
+from sqlalchemy import event, text
+from sqlalchemy.orm import Session
+
+from . import event_log, models
+from .database import AsyncSessionLocal
+
+BATCH_SIZE = int(os.getenv("OUTBOX_BATCH_SIZE", "200"))
+# Fallback poll for events committed by other workers
+POLL_INTERVAL = float(os.getenv("OUTBOX_POLL_INTERVAL", "1"))
+
+_PENDING = "outbox_pending"
+
+CLAIM_SQL = text("""
+DELETE FROM outbox_events
+WHERE id IN (
+    SELECT id FROM outbox_events
+    ORDER BY id
+    LIMIT :batch_size
+    FOR UPDATE SKIP LOCKED
+)
+RETURNING id, envelope
+""")
+
+_loop: Optional[asyncio.AbstractEventLoop] = None
+_wakeup: Optional[asyncio.Event] = None
+
+
+def add(db, envelope: dict):
+    """Queue an envelope in the caller's transaction (Session or AsyncSession)."""
+    db.add(models.OutboxEvent(envelope=jsonable_encoder(envelope)))
+    db.info[_PENDING] = True
+
+
+@event.listens_for(Session, "after_commit")
+def _wake_dispatcher(session):
+    # Sync sessions commit on threadpool threads, hence call_soon_threadsafe
+    if session.info.pop(_PENDING, False) and _loop is not None:
+        _loop.call_soon_threadsafe(_wakeup.set)
+
+
+@event.listens_for(Session, "after_rollback")
+def _discard_pending(session):
+    session.info.pop(_PENDING, None)
+
+
+async def drain_batch(db, publish: Callable[[dict], Awaitable[None]]) -> int:
+    rows = sorted((await db.execute(CLAIM_SQL, {"batch_size": BATCH_SIZE})).all())
+    envelopes = [envelope for _, envelope in rows]
+    # User events get per-user sequence numbers and are kept for replay; the
+    # numbering locks stay held until commit, so publish before committing
+    await event_log.stamp(db, envelopes)
+    for envelope in envelopes:
+        await publish(envelope)
+    await db.commit()
+    return len(rows)
+
+
+async def run_dispatcher(publish: Callable[[dict], Awaitable[None]]):
+    """Background task publishing committed events through `publish`."""
+    global _loop, _wakeup
+    _loop = asyncio.get_running_loop()
+    _wakeup = asyncio.Event()
+    while True:
+        try:
+            async with AsyncSessionLocal() as db:
+                while await drain_batch(db, publish) == BATCH_SIZE:
+                    pass
+        except Exception as e:
+            # The claimed batch is rolled back and retried
+            print(f"Error dispatching outbox events: {e}")
+        try:
+            await asyncio.wait_for(_wakeup.wait(), POLL_INTERVAL)
+        except asyncio.TimeoutError:
+            pass
+        _wakeup.clear()
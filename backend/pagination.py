@@ -0,0 +1,21 @@
+import base64
+import binascii
+import json
+from datetime import datetime
+from typing import Tuple
+
+# Opaque keyset cursors shared by the paginated endpoints.
+# A cursor encodes the (timestamp, id) pair of the last row a client has seen,
+# so the next page is fetched with an indexed range scan instead of OFFSET.
+
+def encode_cursor(timestamp: datetime, row_id: str) -> str:
+    raw = json.dumps([timestamp.isoformat(), row_id]).encode("utf-8")
+    return base64.urlsafe_b64encode(raw).decode("ascii").rstrip("=")
+
+def decode_cursor(cursor: str) -> Tuple[datetime, str]:
+    padded = cursor + "=" * (-len(cursor) % 4)
+    try:
+        timestamp, row_id = json.loads(base64.urlsafe_b64decode(padded.encode("ascii")))
+        return datetime.fromisoformat(timestamp), str(row_id)
+    except (binascii.Error, UnicodeError, ValueError, TypeError) as e:
+        raise ValueError("Invalid cursor") from e
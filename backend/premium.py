@@ -0,0 +1,134 @@
+"""
+Premium membership reminder/expiry scheduling.
+
+Each premium user carries `premium_next_check_at`, the next moment a reminder
+or the expiry itself is due. The scheduler only ever touches rows whose time
+has come, in bulk batches, instead of scanning every premium user.
+"""
+import uuid
+from datetime import datetime, timedelta
+from typing import List, Optional, Tuple
+
+from sqlalchemy import func, select, update
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from . import models, notifications
+
+# Arbitrary constant identifying the scheduler's advisory lock
+SCHEDULER_LOCK_KEY = 7304001
+BATCH_SIZE = 500
+
+# Reminder windows, widest first
+REMINDERS = [
+    ("30d", timedelta(days=30), "Your premium membership expires in 1 month. Plan ahead!"),
+    ("14d", timedelta(days=14), "Your premium membership expires in 2 weeks."),
+    ("7d", timedelta(days=7), "Your premium membership expires in 1 week."),
+    ("3d", timedelta(days=3), "Your premium membership expires in 3 days. Renew now!"),
+    ("2d", timedelta(days=2), "Your premium membership expires in 2 days. Don't forget to renew!"),
+    ("1d", timedelta(days=1), "Your premium membership expires in 1 day! Renew now to stay premium."),
+]
+_RANK = {name: i for i, (name, _, _) in enumerate(REMINDERS)}
+
+
+def next_check_at(expiry: Optional[datetime], last_reminder: Optional[str]) -> Optional[datetime]:
+    """When the next unsent reminder (or the expiry itself) becomes due."""
+    if expiry is None:
+        return None
+    next_rank = _RANK.get(last_reminder, -1) + 1
+    if next_rank < len(REMINDERS):
+        return expiry - REMINDERS[next_rank][1]
+    return expiry
+
+
+def schedule(user: models.User):
+    """Recompute a user's next check after their premium fields changed."""
+    if user.is_premium:
+        user.premium_next_check_at = next_check_at(user.premium_expiry_date, user.last_premium_reminder)
+    else:
+        user.premium_next_check_at = None
+
+
+def due_reminder(expiry: datetime, last_reminder: Optional[str], now: datetime) -> Optional[int]:
+    """Index of the tightest reminder window `now` falls in, if not sent yet."""
+    time_left = expiry - now
+    window = None
+    for i, (_, delta, _) in enumerate(REMINDERS):
+        if time_left <= delta:
+            window = i
+    if window is not None and window > _RANK.get(last_reminder, -1):
+        return window
+    return None
+
+
+async def process_due_batch(db: AsyncSession, now: datetime) -> Optional[Tuple[int, List[Tuple[str, dict]]]]:
+    """
+    Handle up to BATCH_SIZE due users inside the caller's transaction.
+    Returns (rows processed, real-time pushes to send after commit), or None
+    when another worker holds the scheduler lock.
+    """
+    if not await db.scalar(select(func.pg_try_advisory_xact_lock(SCHEDULER_LOCK_KEY))):
+        return None
+
+    rows = (await db.execute(
+        select(
+            models.User.id,
+            models.User.premium_expiry_date,
+            models.User.last_premium_reminder
+        ).where(
+            models.User.premium_next_check_at <= now
+        ).order_by(models.User.premium_next_check_at).limit(BATCH_SIZE).with_for_update(skip_locked=True)
+    )).all()
+
+    user_updates = []
+    new_notifications = []
+    pushes = []
+    for user_id, expiry, last_reminder in rows:
+        if expiry is None or expiry <= now:
+            # Downgrade user
+            user_updates.append({
+                "id": user_id,
+                "is_premium": False,
+                "premium_expiry_date": None,
+                "last_premium_reminder": "expired",
+                "premium_next_check_at": None,
+            })
+            new_notifications.append({
+                "id": str(uuid.uuid4()),
+                "user_id": user_id,
+                "title": "Premium Membership Expired",
+                "message": "Your premium membership has expired. Upgrade now to continue enjoying premium benefits!",
+                "type": "system",
+                "group_key": notifications.GROUP_PREMIUM,
+            })
+            pushes.append((user_id, {"type": "profile_updated", "user_id": user_id}))
+            continue
+
+        window = due_reminder(expiry, last_reminder, now)
+        if window is not None:
+            last_reminder, _, message = REMINDERS[window]
+            new_notifications.append({
+                "id": str(uuid.uuid4()),
+                "user_id": user_id,
+                "title": "Premium Renewal Reminder",
+                "message": message,
+                "type": "system",
+                "group_key": notifications.GROUP_PREMIUM,
+            })
+            pushes.append((user_id, {"type": "new_notification", "title": "Premium Renewal Reminder"}))
+        user_updates.append({
+            "id": user_id,
+            "last_premium_reminder": last_reminder,
+            "premium_next_check_at": next_check_at(expiry, last_reminder),
+        })
+
+    # Bulk statements: one executemany UPDATE by primary key, one upsert that
+    # replaces any unread reminder with the latest one
+    if user_updates:
+        await db.execute(update(models.User), user_updates)
+    if new_notifications:
+        await db.execute(notifications.upsert_grouped(), new_notifications)
+    return len(rows), pushes
+
+
+async def next_due_at(db: AsyncSession) -> Optional[datetime]:
+    return await db.scalar(select(func.min(models.User.premium_next_check_at)))
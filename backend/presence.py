@@ -0,0 +1,176 @@
+"""
+In-memory presence registry and typing-indicator coalescing.
+
+Presence: a user is online while they have an open socket (dead connections
+are closed by uvicorn's protocol-level pings). Clients that opt in by
+sending {"type": "ping"} periodically are also held to PRESENCE_TIMEOUT: every
+frame they send counts as a heartbeat, and without one they show as offline
+while the socket stays open (e.g. a backgrounded app). Each worker announces
+its users' transitions, plus a periodic snapshot, over the backplane, so every
+worker's registry answers for sockets held anywhere.
+
+Typing: typing_started/typing_stopped frames are coalesced per (sender,
+receiver). Repeated starts only extend the current state, a stop is held for
+TYPING_DEBOUNCE in case typing resumes, and a state that is not refreshed
+within TYPING_TTL expires as if the sender had stopped. The app sends one start
+per burst and a stop after 1 s idle, never refreshing, so TYPING_TTL only
+catches stops that never arrive and must outlast a long burst.
+"""
+import os
+import time
+import uuid
+from datetime import datetime, timezone
+from typing import Dict, List, Optional, Tuple
+
+PRESENCE_TIMEOUT = float(os.getenv("PRESENCE_TIMEOUT", "60"))
+# How often each worker re-announces the users connected to it
+PRESENCE_ANNOUNCE_INTERVAL = float(os.getenv("PRESENCE_ANNOUNCE_INTERVAL", "20"))
+# Entries from a worker that stopped announcing are dropped after this long
+REMOTE_TTL = PRESENCE_ANNOUNCE_INTERVAL * 3
+# Users per snapshot envelope, keeping NOTIFY payloads well under their limit
+SNAPSHOT_CHUNK = 100
+
+TYPING_TTL = float(os.getenv("TYPING_TTL", "30"))
+TYPING_DEBOUNCE = float(os.getenv("TYPING_DEBOUNCE", "1.5"))
+
+
+def _now_iso() -> str:
+    return datetime.now(timezone.utc).isoformat()
+
+
+class PresenceRegistry:
+    def __init__(self):
+        self.worker_id = str(uuid.uuid4())
+        # Sockets on this worker: user_id -> [connection count, last heartbeat, announced online, sends pings]
+        self._local: Dict[str, list] = {}
+        # Announcements from every worker (this one included): user_id -> {worker_id: received at}
+        self._online: Dict[str, Dict[str, float]] = {}
+        self._last_seen: Dict[str, str] = {}
+
+    def _envelope(self, online: List[str] = (), offline: List[str] = ()) -> dict:
+        return {
+            "target": "presence",
+            "worker": self.worker_id,
+            "online": list(online),
+            "offline": list(offline),
+            "at": _now_iso(),
+        }
+
+    # -- local sockets; each returns an envelope to publish on a transition --
+
+    def connected(self, user_id: str) -> Optional[dict]:
+        entry = self._local.setdefault(user_id, [0, 0.0, False, False])
+        entry[0] += 1
+        return self.heartbeat(user_id)
+
+    def heartbeat(self, user_id: str, ping: bool = False) -> Optional[dict]:
+        entry = self._local.get(user_id)
+        if entry is None:
+            return None
+        entry[1] = time.monotonic()
+        entry[3] = entry[3] or ping
+        if not entry[2]:
+            entry[2] = True
+            return self._envelope(online=[user_id])
+        return None
+
+    def disconnected(self, user_id: str) -> Optional[dict]:
+        entry = self._local.get(user_id)
+        if entry is None:
+            return None
+        entry[0] -= 1
+        if entry[0] > 0:
+            return None
+        del self._local[user_id]
+        return self._envelope(offline=[user_id]) if entry[2] else None
+
+    def connected_here(self, user_id: str) -> bool:
+        return user_id in self._local
+
+    def expire_stale(self) -> Optional[dict]:
+        """Mark users whose pinging sockets stopped sending heartbeats as offline."""
+        cutoff = time.monotonic() - PRESENCE_TIMEOUT
+        stale = []
+        for user_id, entry in self._local.items():
+            if entry[2] and entry[3] and entry[1] < cutoff:
+                entry[2] = False
+                stale.append(user_id)
+        return self._envelope(offline=stale) if stale else None
+
+    def snapshots(self) -> List[dict]:
+        online = [user_id for user_id, entry in self._local.items() if entry[2]]
+        return [
+            self._envelope(online=online[i:i + SNAPSHOT_CHUNK])
+            for i in range(0, len(online), SNAPSHOT_CHUNK)
+        ]
+
+    # -- announcements from all workers --
+
+    def apply(self, envelope: dict):
+        worker = envelope.get("worker")
+        received = time.monotonic()
+        for user_id in envelope.get("online", []):
+            self._online.setdefault(user_id, {})[worker] = received
+        for user_id in envelope.get("offline", []):
+            workers = self._online.get(user_id)
+            if workers is not None:
+                workers.pop(worker, None)
+                if not workers:
+                    del self._online[user_id]
+            self._last_seen[user_id] = envelope.get("at") or _now_iso()
+
+    def prune(self):
+        """Forget workers that stopped announcing (e.g. crashed)."""
+        cutoff = time.monotonic() - REMOTE_TTL
+        for user_id in list(self._online):
+            workers = self._online[user_id]
+            for worker in [w for w, at in workers.items() if at < cutoff]:
+                del workers[worker]
+            if not workers:
+                del self._online[user_id]
+                self._last_seen[user_id] = _now_iso()
+
+    def status(self, user_id: str) -> dict:
+        online = bool(self._online.get(user_id))
+        return {"online": online, "last_seen": None if online else self._last_seen.get(user_id)}
+
+
+class TypingTracker:
+    def __init__(self):
+        # (sender, receiver) -> [expires at, stop due at or None]
+        self._states: Dict[Tuple[str, str], list] = {}
+
+    def started(self, sender_id: str, receiver_id: str) -> bool:
+        """Record a start; True when it should be forwarded."""
+        now = time.monotonic()
+        state = self._states.get((sender_id, receiver_id))
+        if state is not None:
+            # Already shown as typing: refresh, and cancel a pending stop
+            state[0] = now + TYPING_TTL
+            state[1] = None
+            return False
+        self._states[(sender_id, receiver_id)] = [now + TYPING_TTL, None]
+        return True
+
+    def stopped(self, sender_id: str, receiver_id: str):
+        state = self._states.get((sender_id, receiver_id))
+        if state is not None and state[1] is None:
+            state[1] = time.monotonic() + TYPING_DEBOUNCE
+
+    def due(self) -> List[Tuple[str, str]]:
+        """Pairs whose typing_stopped should be sent now (debounced stops and expiries)."""
+        now = time.monotonic()
+        finished = [
+            pair for pair, (expires, stop_at) in self._states.items()
+            if expires <= now or (stop_at is not None and stop_at <= now)
+        ]
+        for pair in finished:
+            del self._states[pair]
+        return finished
+
+    def clear_sender(self, sender_id: str) -> List[str]:
+        """Drop a disconnected sender's states; returns the receivers to notify."""
+        receivers = [receiver for sender, receiver in self._states if sender == sender_id]
+        for receiver in receivers:
+            del self._states[(sender_id, receiver)]
+        return receivers
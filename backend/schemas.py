@@ -1,7 +1,9 @@
-from pydantic import BaseModel, ConfigDict, field_validator
-from typing import List, Optional
+from pydantic import BaseModel, ConfigDict, field_validator, computed_field
+from typing import Dict, List, Optional
 from datetime import datetime
 
+from . import images, notifications
+
 class UserBase(BaseModel):
     name: str
     phone: Optional[str] = None
@@ -55,6 +57,12 @@ class UserResponse(UserBase):
     created_at: datetime
     model_config = ConfigDict(from_attributes=True)
 
+    @computed_field
+    @property
+    def photo_variants(self) -> List[Optional[Dict[str, str]]]:
+        # Resized thumb/card/full URLs per photo, in the same order as `photos`
+        return [images.variant_urls(photo) for photo in self.photos]
+
 class InterestCreate(BaseModel):
     id: str
     sender_id: str
@@ -82,6 +90,7 @@ class AnalyticsResponse(BaseModel):
     recent_registrations: int
     male_users: int
     female_users: int
+    breakdowns: Optional[dict] = None
 
 class AdminLogin(BaseModel):
     username: str
@@ -114,7 +123,15 @@ class NotificationResponse(BaseModel):
     is_read: bool
     related_user_id: Optional[str] = None
     timestamp: datetime
+    actor_count: int = 1
+    actor_ids: Optional[List[str]] = None
     model_config = ConfigDict(from_attributes=True)
+
+    @field_validator('actor_ids')
+    @classmethod
+    def recent_actors(cls, v):
+        # Only the most recent actors are listed
+        return v[:notifications.MAX_ACTORS] if v else v
 class UserAnalytics(BaseModel):
     total_views: int
     interests_received: int
@@ -145,6 +162,9 @@ class ConversationResponse(BaseModel):
     other_user_id: str
     other_user_name: str
     other_user_photo: Optional[str] = None
+    other_user_photo_variants: Optional[Dict[str, str]] = None
+    other_user_online: bool = False
+    other_user_last_seen: Optional[datetime] = None
     last_message: str
     last_message_time: datetime
     unread_count: int
@@ -0,0 +1,53 @@
+import os
+import sys
+from sqlalchemy import text
+
+# Add project root to path to import backend modules
+sys.path.append(os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))))
+
+from backend.database import engine
+from backend import models
+from backend.conversations import PREVIEW_LENGTH
+
+# Rebuild every inbox row from chat_messages: the latest message and the
+# unread count for each (user, partner) pair, seen from both sides.
+BACKFILL_SQL = f"""
+INSERT INTO conversations
+    (user_id, partner_id, last_message_id, last_message, last_message_time, last_sender_id, unread_count)
+SELECT user_id, partner_id, id, LEFT(text, {PREVIEW_LENGTH}), timestamp, sender_id, unread_count
+FROM (
+    SELECT m.id, m.text, m.timestamp, m.sender_id, p.user_id, p.partner_id,
+           row_number() OVER (
+               PARTITION BY p.user_id, p.partner_id
+               ORDER BY m.timestamp DESC, m.id DESC
+           ) AS recency_rank,
+           count(*) FILTER (WHERE m.receiver_id = p.user_id AND m.is_read = false) OVER (
+               PARTITION BY p.user_id, p.partner_id
+           ) AS unread_count
+    FROM chat_messages m
+    CROSS JOIN LATERAL (VALUES (m.sender_id, m.receiver_id), (m.receiver_id, m.sender_id))
+        AS p(user_id, partner_id)
+    WHERE m.sender_id IS NOT NULL AND m.receiver_id IS NOT NULL
+) ranked
+WHERE recency_rank = 1
+ON CONFLICT (user_id, partner_id) DO UPDATE SET
+    last_message_id = EXCLUDED.last_message_id,
+    last_message = EXCLUDED.last_message,
+    last_message_time = EXCLUDED.last_message_time,
+    last_sender_id = EXCLUDED.last_sender_id,
+    unread_count = EXCLUDED.unread_count
+"""
+
+def backfill():
+    models.Conversation.__table__.create(bind=engine, checkfirst=True)
+    with engine.connect() as conn:
+        try:
+            result = conn.execute(text(BACKFILL_SQL))
+            conn.commit()
+            print(f"Backfilled {result.rowcount} conversation rows.")
+        except Exception as e:
+            print(f"Error backfilling conversations: {e}")
+
+if __name__ == "__main__":
+    backfill()
+    print("Backfill finished.")
@@ -0,0 +1,25 @@
+import argparse
+import asyncio
+import os
+import sys
+
+# Add project root to path to import backend modules
+sys.path.append(os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))))
+
+from backend.database import engine
+from backend import models, media
+
+async def run(reconcile):
+    return await media.gc_exclusive(reconcile)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Remove stored uploads that are no longer referenced")
+    parser.add_argument("--skip-reconcile", action="store_true", help="trust the current reference counts")
+    args = parser.parse_args()
+
+    models.MediaBlob.__table__.create(bind=engine, checkfirst=True)
+    result = asyncio.run(run(not args.skip_reconcile))
+    if result is None:
+        print("Media GC is already running elsewhere, try again later.")
+        sys.exit(1)
+    print(f"Reference counts corrected: {result['reconciled']}, files removed: {result['removed']}")
@@ -0,0 +1,35 @@
+import argparse
+import asyncio
+import json
+import os
+import sys
+
+# Add project root to path to import backend modules
+sys.path.append(os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))))
+
+from backend.database import AsyncSessionLocal
+from backend import importer
+
+async def run(path, fmt, batch_size):
+    async with AsyncSessionLocal() as db:
+        with open(path, encoding="utf-8-sig", newline="") as f:
+            return await importer.import_profiles(db, f, fmt, batch_size)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Bulk import profiles from a CSV or NDJSON file")
+    parser.add_argument("path")
+    parser.add_argument("--format", choices=["csv", "ndjson"], help="defaults to the file extension")
+    parser.add_argument("--batch-size", type=int, default=importer.BATCH_SIZE,
+                        help=f"rows per INSERT, at most {importer.MAX_BATCH_SIZE}")
+    parser.add_argument("--report", help="write the per-row error report to this JSON file")
+    args = parser.parse_args()
+
+    report = asyncio.run(run(args.path, args.format or importer.detect_format(args.path), args.batch_size))
+    print(f"Imported: {report['imported']}, skipped (already exist): {report['skipped']}, invalid: {report['failed']}")
+    if args.report:
+        with open(args.report, "w") as f:
+            json.dump(report["errors"], f, indent=2)
+        print(f"Error report written to {args.report}")
+    else:
+        for entry in report["errors"]:
+            print(f"Row {entry['row']} ({entry['id']}): {'; '.join(entry['errors'])}")
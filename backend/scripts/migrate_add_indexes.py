@@ -0,0 +1,24 @@
+import os
+import sys
+
+# Add project root to path to import backend modules
+sys.path.append(os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))))
+
+from backend.database import engine
+from backend import models
+
+def migrate():
+    # Indexes declared on the models are only created by create_all() for
+    # brand-new tables, so existing databases need them added explicitly.
+    for table in models.Base.metadata.sorted_tables:
+        for index in table.indexes:
+            try:
+                print(f"Creating index {index.name}...")
+                index.create(bind=engine, checkfirst=True)
+                print(f"Index {index.name} ready.")
+            except Exception as e:
+                print(f"Error creating {index.name}: {e}")
+
+if __name__ == "__main__":
+    migrate()
+    print("Migration finished.")
@@ -0,0 +1,54 @@
+import os
+import sys
+from sqlalchemy import text
+
+# Add project root to path to import backend modules
+sys.path.append(os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))))
+
+from backend.database import engine
+from backend import models
+
+COLUMNS = [
+    ("group_key", "VARCHAR"),
+    ("actor_count", "INTEGER NOT NULL DEFAULT 1"),
+    ("actor_ids", "VARCHAR[]"),
+]
+
+def migrate():
+    with engine.connect() as conn:
+        for column, column_type in COLUMNS:
+            try:
+                print(f"Adding column {column}...")
+                conn.execute(text(f"ALTER TABLE notifications ADD COLUMN {column} {column_type}"))
+                conn.commit()
+                print(f"Successfully added {column}.")
+            except Exception as e:
+                conn.rollback()
+                if "already exists" in str(e).lower():
+                    print(f"Column {column} already exists, skipping.")
+                else:
+                    print(f"Error adding {column}: {e}")
+
+        conn.execute(text(
+            "CREATE UNIQUE INDEX IF NOT EXISTS ix_notifications_open_group ON notifications (user_id, group_key) "
+            "WHERE is_read = false AND group_key IS NOT NULL"
+        ))
+        conn.execute(text(
+            "CREATE INDEX IF NOT EXISTS ix_notifications_read_timestamp ON notifications (timestamp) "
+            "WHERE is_read = true"
+        ))
+        conn.commit()
+
+        # Viewers already merged into open aggregates must not be counted again
+        models.NotificationActor.__table__.create(bind=conn, checkfirst=True)
+        conn.execute(text(
+            "INSERT INTO notification_actors (notification_id, actor_id) "
+            "SELECT id, unnest(actor_ids) FROM notifications "
+            "WHERE is_read = false AND group_key = 'profileView' AND actor_ids IS NOT NULL "
+            "ON CONFLICT DO NOTHING"
+        ))
+        conn.commit()
+
+if __name__ == "__main__":
+    migrate()
+    print("Migration finished.")
@@ -0,0 +1,38 @@
+import os
+import sys
+from sqlalchemy import text
+
+# Add project root to path to import backend modules
+sys.path.append(os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))))
+
+from backend.database import engine
+
+def migrate():
+    with engine.connect() as conn:
+        try:
+            print("Adding column premium_next_check_at...")
+            conn.execute(text("ALTER TABLE users ADD COLUMN premium_next_check_at TIMESTAMP WITH TIME ZONE"))
+            conn.commit()
+            print("Successfully added premium_next_check_at.")
+        except Exception as e:
+            conn.rollback()
+            if "already exists" in str(e).lower():
+                print("Column premium_next_check_at already exists, skipping.")
+            else:
+                print(f"Error adding premium_next_check_at: {e}")
+
+        conn.execute(text(
+            "CREATE INDEX IF NOT EXISTS ix_users_premium_next_check_at ON users (premium_next_check_at)"
+        ))
+        # Mark existing premium members as due; the scheduler works out each
+        # user's real next check on its first pass.
+        result = conn.execute(text(
+            "UPDATE users SET premium_next_check_at = now() "
+            "WHERE is_premium = true AND premium_expiry_date IS NOT NULL AND premium_next_check_at IS NULL"
+        ))
+        conn.commit()
+        print(f"Scheduled {result.rowcount} premium users.")
+
+if __name__ == "__main__":
+    migrate()
+    print("Migration finished.")
@@ -0,0 +1,31 @@
+import os
+import sys
+from sqlalchemy import text
+
+# Add project root to path to import backend modules
+sys.path.append(os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))))
+
+from backend.database import engine
+from backend import models
+
+# Continue each user's numbering after the events already logged (which were
+# numbered by outbox id), so clients' last_seq values stay valid
+SEED_SQL = """
+INSERT INTO user_event_seqs (user_id, last_seq)
+SELECT user_id, max(seq) FROM user_events GROUP BY user_id
+ON CONFLICT (user_id) DO UPDATE SET last_seq = GREATEST(user_event_seqs.last_seq, EXCLUDED.last_seq)
+"""
+
+def migrate():
+    models.UserEventSeq.__table__.create(bind=engine, checkfirst=True)
+    with engine.connect() as conn:
+        try:
+            result = conn.execute(text(SEED_SQL))
+            conn.commit()
+            print(f"Seeded sequence numbers for {result.rowcount} users.")
+        except Exception as e:
+            print(f"Error seeding user event sequence numbers: {e}")
+
+if __name__ == "__main__":
+    migrate()
+    print("Migration finished.")
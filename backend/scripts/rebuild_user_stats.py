@@ -0,0 +1,47 @@
+import os
+import sys
+from sqlalchemy import text
+
+# Add project root to path to import backend modules
+sys.path.append(os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))))
+
+from backend.database import engine
+from backend import models
+
+# Recompute every user's counters from interests and shortlists
+REBUILD_SQL = """
+INSERT INTO user_stats (user_id, interests_received_pending, interests_sent, shortlisted_by)
+SELECT u.id,
+       COALESCE(received.count, 0),
+       COALESCE(sent.count, 0),
+       COALESCE(shortlisted.count, 0)
+FROM users u
+LEFT JOIN (
+    SELECT receiver_id AS user_id, count(*) AS count FROM interests
+    WHERE status = 'pending' GROUP BY receiver_id
+) received ON received.user_id = u.id
+LEFT JOIN (
+    SELECT sender_id AS user_id, count(*) AS count FROM interests GROUP BY sender_id
+) sent ON sent.user_id = u.id
+LEFT JOIN (
+    SELECT shortlisted_user_id AS user_id, count(*) AS count FROM shortlists GROUP BY shortlisted_user_id
+) shortlisted ON shortlisted.user_id = u.id
+ON CONFLICT (user_id) DO UPDATE SET
+    interests_received_pending = EXCLUDED.interests_received_pending,
+    interests_sent = EXCLUDED.interests_sent,
+    shortlisted_by = EXCLUDED.shortlisted_by
+"""
+
+def rebuild():
+    models.UserStats.__table__.create(bind=engine, checkfirst=True)
+    with engine.connect() as conn:
+        try:
+            result = conn.execute(text(REBUILD_SQL))
+            conn.commit()
+            print(f"Rebuilt counters for {result.rowcount} users.")
+        except Exception as e:
+            print(f"Error rebuilding user stats: {e}")
+
+if __name__ == "__main__":
+    rebuild()
+    print("Rebuild finished.")
@@ -0,0 +1,68 @@
+"""
+Streaming upload storage.
+
+Uploads are copied to a temp file in fixed-size chunks with every blocking
+write pushed off the event loop. The content hash is computed while streaming
+and the size cap is enforced chunk by chunk. The staged file is then moved to
+its final name with an atomic rename (see media.py for where that is).
+"""
+import asyncio
+import hashlib
+import os
+import tempfile
+from dataclasses import dataclass
+
+from fastapi import UploadFile
+
+UPLOAD_DIR = "backend/uploads"
+MAX_UPLOAD_BYTES = int(os.getenv("UPLOAD_MAX_BYTES", str(10 * 1024 * 1024)))
+CHUNK_SIZE = int(os.getenv("UPLOAD_CHUNK_SIZE", str(1024 * 1024)))
+
+
+class UploadTooLarge(Exception):
+    """Raised when an upload exceeds MAX_UPLOAD_BYTES."""
+
+
+@dataclass
+class StagedFile:
+    tmp_path: str
+    extension: str
+    size: int
+    sha256: str
+
+
+async def stage_upload(file: UploadFile, max_bytes: int = MAX_UPLOAD_BYTES) -> StagedFile:
+    extension = os.path.splitext(file.filename or "")[1].lower()
+    # Temp file on the same filesystem so the final rename is atomic
+    fd, tmp_path = await asyncio.to_thread(tempfile.mkstemp, dir=UPLOAD_DIR, prefix=".upload-")
+    digest = hashlib.sha256()
+    size = 0
+    try:
+        with os.fdopen(fd, "wb") as out:
+            while True:
+                chunk = await file.read(CHUNK_SIZE)
+                if not chunk:
+                    break
+                size += len(chunk)
+                if size > max_bytes:
+                    raise UploadTooLarge(f"File exceeds the {max_bytes} byte limit")
+                digest.update(chunk)
+                await asyncio.to_thread(out.write, chunk)
+            await asyncio.to_thread(out.flush)
+    except BaseException:
+        await asyncio.to_thread(remove_quietly, tmp_path)
+        raise
+    return StagedFile(tmp_path=tmp_path, extension=extension, size=size, sha256=digest.hexdigest())
+
+
+def move_into_place(tmp_path: str, relative_path: str):
+    final_path = os.path.join(UPLOAD_DIR, relative_path)
+    os.makedirs(os.path.dirname(final_path), exist_ok=True)
+    os.replace(tmp_path, final_path)
+
+
+def remove_quietly(path: str):
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
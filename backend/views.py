@@ -0,0 +1,107 @@
+"""
+Write-behind buffering of profile views.
+
+GET /profiles/{id} only records the view in memory; a background task flushes
+the accumulated counts as one batched UPDATE and merges the new viewers into
+each owner's coalesced "Profile Viewed" notification (see
+notifications.coalesce_views). View counts are therefore eventually accurate,
+with at most one flush interval of lag.
+"""
+import os
+import threading
+from collections import Counter
+from typing import List, Set, Tuple
+
+from sqlalchemy import text
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from . import notifications, outbox
+
+FLUSH_INTERVAL = float(os.getenv("VIEW_FLUSH_INTERVAL", "10"))
+# Bound on remembered (profile, viewer) pairs; the database check still
+# prevents duplicates after the set is reset
+MAX_NOTIFIED_PAIRS = int(os.getenv("VIEW_NOTIFIED_CACHE_SIZE", "100000"))
+
+FLUSH_VIEWS_SQL = text("""
+UPDATE users u SET view_count = COALESCE(u.view_count, 0) + d.views
+FROM (
+    SELECT d.user_id, sum(d.views) AS views
+    FROM unnest(CAST(:user_ids AS text[]), CAST(:viewer_ids AS text[]), CAST(:views AS integer[]))
+        AS d(user_id, viewer_id, views)
+    JOIN users viewer ON viewer.id = d.viewer_id
+    GROUP BY d.user_id
+) d
+WHERE u.id = d.user_id
+""")
+
+class ViewBuffer:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._views: Counter = Counter()
+        self._views_by_user: Counter = Counter()
+        self._new_pairs: List[Tuple[str, str]] = []
+        self._notified = set()
+
+    def record(self, user_id: str, viewer_id: str):
+        with self._lock:
+            self._views[(user_id, viewer_id)] += 1
+            self._views_by_user[user_id] += 1
+            pair = (user_id, viewer_id)
+            if pair not in self._notified:
+                if len(self._notified) >= MAX_NOTIFIED_PAIRS:
+                    self._notified.clear()
+                self._notified.add(pair)
+                self._new_pairs.append(pair)
+
+    def pending_views(self, user_id: str) -> int:
+        """Views recorded for a profile but not yet flushed."""
+        with self._lock:
+            return self._views_by_user.get(user_id, 0)
+
+    def _take(self):
+        with self._lock:
+            views, self._views = self._views, Counter()
+            self._views_by_user = Counter()
+            pairs, self._new_pairs = self._new_pairs, []
+        return views, pairs
+
+    def _restore(self, views: Counter, pairs: List[Tuple[str, str]]):
+        with self._lock:
+            self._views.update(views)
+            for (user_id, _), count in views.items():
+                self._views_by_user[user_id] += count
+            self._new_pairs.extend(pairs)
+
+    async def flush(self, db: AsyncSession) -> Set[str]:
+        """
+        Write buffered views and queue a real-time push for every owner whose
+        notification changed. Returns the profiles whose view_count changed.
+        """
+        views, pairs = self._take()
+        if not views and not pairs:
+            return set()
+        try:
+            if views:
+                keys = list(views)
+                await db.execute(FLUSH_VIEWS_SQL, {
+                    "user_ids": [user_id for user_id, _ in keys],
+                    "viewer_ids": [viewer_id for _, viewer_id in keys],
+                    "views": [views[key] for key in keys],
+                })
+            if pairs:
+                for owner_id in await notifications.coalesce_views(db, pairs):
+                    outbox.add(db, {
+                        "target": "user",
+                        "user_id": owner_id,
+                        "message": {"type": "new_notification", "title": "Profile Viewed"},
+                    })
+            await db.commit()
+            return {user_id for user_id, _ in views}
+        except Exception:
+            await db.rollback()
+            # Keep the views for the next attempt
+            self._restore(views, pairs)
+            raise
+
+
+view_buffer = ViewBuffer()